@@ -1,9 +1,22 @@
 from fastapi import HTTPException
+from sqlalchemy import and_, func, or_
+from sqlalchemy.exc import IntegrityError
 
 import models
 
-from database import SessionLocal
-from utils import calculate_emi
+from database import SessionLocal, engine, pin_reads_to_primary, reads_pinned_to_primary, shard_engines, shard_router
+from loan_store import load_loan_store, load_loan_links
+from metrics import timed
+from schedule_cache import (get_schedule_cache, cache_key, pack_schedule, unpack_schedule, pack_summary,
+                            unpack_summary)
+from amortization import build_schedule, build_summary, project_summary
+from compute_pool import run_cpu
+from sharding import first_shard_bind_arguments, shard_bind_arguments, user_emails_table
+from singleflight import SingleFlight
+from write_batch import get_write_batcher
+
+# loan terms never change once created, so identical concurrent lookups can share one query
+_loan_terms_flight = SingleFlight("loan_terms")
 
 
 class DataService:
@@ -14,6 +27,29 @@ class DataService:
     def __init__(self, model):
         self._model = model
 
+    def _write(self, operation):
+        """
+        runs a write in its own transaction, or hands it to the group commit batcher when enabled
+        :param operation: callable(session) -> result, writes and flushes but does not commit
+        :return: the operation's result after commit
+        """
+        batcher = get_write_batcher()
+        if batcher is not None:
+            result = batcher.submit(operation)
+            # committed on the batcher's thread, outside this request's read consistency
+            pin_reads_to_primary()
+            return result
+        db_session = SessionLocal(expire_on_commit=False, info={"primary": True})
+        try:
+            result = operation(db_session)
+            db_session.commit()
+            return result
+        except Exception as e:
+            db_session.rollback()
+            raise e
+        finally:
+            db_session.close()
+
     def write_user(self, email, first_name, last_name):
         """
         creates a new user entry into users table after validating user does not already exist based on email
@@ -22,25 +58,27 @@ class DataService:
         :param last_name:
         :return:
         """
-        db_session = SessionLocal()
-
-        try:
-            # check if user already exists if so then return user object
-            user_obj = db_session.query(self._model).filter(self._model.email == email).first()
-            if user_obj:
+        return self._write(lambda db_session: self._write_user_in(db_session, email, first_name, last_name))
+
+    def _write_user_in(self, db_session, email, first_name, last_name):
+        # check if user already exists if so then return user object
+        user_obj = db_session.query(self._model).filter(self._model.email == email).first()
+        if user_obj:
+            raise HTTPException(status_code=400, detail="user already exists")
+        user_model = self._model(email=email, first_name=first_name, last_name=last_name)
+        db_session.add(user_model)
+        db_session.flush()
+        if shard_router is not None:
+            # the check above can't see a concurrent sign up on another shard, the global table can
+            try:
+                db_session.execute(user_emails_table.insert().values(email=email, user_id=user_model.id),
+                                   bind_arguments=first_shard_bind_arguments(shard_router))
+            except IntegrityError:
                 raise HTTPException(status_code=400, detail="user already exists")
-            user_model = self._model(email=email, first_name=first_name, last_name=last_name)
-            db_session.add(user_model)
-            db_session.commit()
-            db_session.refresh(user_model)
 
-            return {
-                "data": user_model
-            }
-        except Exception as e:
-            raise e
-        finally:
-            db_session.close()
+        return {
+            "data": user_model
+        }
 
     def get_user(self, user_id):
         """
@@ -118,35 +156,34 @@ class DataService:
         :param owner_user_id:
         :return:
         """
-        db_session = SessionLocal()
-        try:
-            loan_model = self._model(amount=loan_amount, interest=loan_interest, term_months=loan_months,
-                                     owner_user_id=owner_user_id)
-            db_session.add(loan_model)
-            db_session.commit()
-            db_session.refresh(loan_model)
-
-            for id in user_ids:
-                user_obj = db_session.query(models.UserModel).filter(models.UserModel.id == id).first()
-                if user_obj:
-                    user_obj.loans.append(loan_model)
-                    db_session.commit()
-
-            return {
-                "message": "loan created",
-                "data": {
-                    "id": loan_model.id,
-                    "amount": loan_model.amount,
-                    "interest": loan_model.interest,
-                    "term_months": loan_model.term_months,
-                    "owner_user_id": loan_model.owner_user_id
-                },
-                "status": 200
-            }
-        except Exception as e:
-            raise e
-        finally:
-            db_session.close()
+        return self._write(lambda db_session: self._create_loan_in(db_session, user_ids, loan_amount, loan_interest,
+                                                                   loan_months, owner_user_id))
+
+    def _create_loan_in(self, db_session, user_ids, loan_amount, loan_interest, loan_months, owner_user_id):
+        loan_model = self._model(amount=loan_amount, interest=loan_interest, term_months=loan_months,
+                                 owner_user_id=owner_user_id)
+        db_session.add(loan_model)
+        db_session.flush()
+
+        existing_user_ids = [row.id for row in db_session.query(models.UserModel.id)
+                             .filter(models.UserModel.id.in_(set(user_ids)))]
+        if existing_user_ids:
+            db_session.execute(
+                models.association_table.insert(),
+                [{"user_id": user_id, "loan_id": loan_model.id} for user_id in existing_user_ids],
+                bind_arguments=shard_bind_arguments(shard_router, loan_model.id))
+
+        return {
+            "message": "loan created",
+            "data": {
+                "id": loan_model.id,
+                "amount": loan_model.amount,
+                "interest": loan_model.interest,
+                "term_months": loan_model.term_months,
+                "owner_user_id": loan_model.owner_user_id
+            },
+            "status": 200
+        }
 
     def get_loan(self, loan_id):
         """
@@ -157,13 +194,25 @@ class DataService:
         db_session = SessionLocal()
         try:
             result = db_session.query(self._model).filter(self._model.id == loan_id).first()
-            result.users
             if not result:
                 raise HTTPException(status_code=400, detail="no loan found")
+            # association rows live with the loan, users may live elsewhere, so two lookups instead of a join
+            user_ids = [row.user_id for row in db_session.query(models.association_table.c.user_id)
+                        .filter(models.association_table.c.loan_id == loan_id)]
+            users = []
+            if user_ids:
+                users = db_session.query(models.UserModel).filter(models.UserModel.id.in_(user_ids)).all()
             return {
                 "message": "loan found",
                 "data": {
-                    "loan_details": result
+                    "loan_details": {
+                        "amount": result.amount,
+                        "owner_user_id": result.owner_user_id,
+                        "id": result.id,
+                        "term_months": result.term_months,
+                        "interest": result.interest,
+                        "users": users
+                    }
                 },
                 "status": 200
             }
@@ -172,6 +221,93 @@ class DataService:
         finally:
             db_session.close()
 
+    def _loan_filter_criteria(self, filters):
+        loan = self._model
+        criteria = []
+        if filters.get("owner_user_id") is not None:
+            criteria.append(loan.owner_user_id == filters["owner_user_id"])
+        if filters.get("term_months") is not None:
+            criteria.append(loan.term_months == filters["term_months"])
+        if filters.get("min_amount") is not None:
+            criteria.append(loan.amount >= filters["min_amount"])
+        if filters.get("max_amount") is not None:
+            criteria.append(loan.amount <= filters["max_amount"])
+        if filters.get("min_interest") is not None:
+            criteria.append(loan.interest >= filters["min_interest"])
+        if filters.get("max_interest") is not None:
+            criteria.append(loan.interest <= filters["max_interest"])
+        if filters.get("loan_ids") is not None:
+            criteria.append(loan.id.in_(filters["loan_ids"]))
+        return criteria
+
+    def count_loans(self, filters):
+        """
+        counts loans matching the same filters as list_loans
+        :param filters:
+        :return: int
+        """
+        db_session = SessionLocal()
+        try:
+            # summed per shard when sharded, a single row otherwise
+            counts = db_session.query(func.count(self._model.id)).filter(*self._loan_filter_criteria(filters)).all()
+            return sum(row[0] for row in counts)
+        except Exception as e:
+            raise e
+        finally:
+            db_session.close()
+
+    def list_loans(self, filters, sort_by="id", descending=False, limit=50, after=None):
+        """
+        lists loans matching the filters, ordered by sort_by then id, one keyset page at a time
+        :param filters: dict with any of owner_user_id, min_amount, max_amount, min_interest, max_interest,
+                        term_months, loan_ids
+        :param sort_by: id, amount, interest or term_months
+        :param descending:
+        :param limit: page size
+        :param after: (sort value, id) of the last loan on the previous page
+        :return: (loans, has_more)
+        """
+        loan = self._model
+        sort_column = getattr(loan, sort_by)
+        criteria = self._loan_filter_criteria(filters)
+        if after is not None:
+            last_value, last_id = after
+            if sort_column is loan.id:
+                criteria.append(loan.id < last_id if descending else loan.id > last_id)
+            elif descending:
+                criteria.append(or_(sort_column < last_value, and_(sort_column == last_value, loan.id < last_id)))
+            else:
+                criteria.append(or_(sort_column > last_value, and_(sort_column == last_value, loan.id > last_id)))
+
+        order = [sort_column.desc(), loan.id.desc()] if descending else [sort_column, loan.id]
+        db_session = SessionLocal()
+        try:
+            result = db_session.query(loan).filter(*criteria).order_by(*order).limit(limit + 1).all()
+            # with shards each one returns its own ordered page, merge them before cutting
+            result.sort(key=lambda row: (getattr(row, sort_by), row.id), reverse=descending)
+            return result[:limit], len(result) > limit
+        except Exception as e:
+            raise e
+        finally:
+            db_session.close()
+
+    def loan_store(self, filters, after_id=None, limit=None):
+        """
+        loads matching loans into a compact LoanStore ordered by id, without building ORM objects
+        :param filters: same as list_loans
+        :param after_id: only loans with a larger id
+        :param limit: at most this many loans
+        :return: LoanStore
+        """
+        return load_loan_store(shard_engines or [engine], self._loan_filter_criteria(filters), after_id, limit)
+
+    def loan_links(self):
+        """
+        loads every user <-> loan link into CSR arrays
+        :return: LoanLinks
+        """
+        return load_loan_links(shard_engines or [engine])
+
     def get_user_loans(self, user_id):
         """
         gets all loans associated to a user
@@ -183,7 +319,11 @@ class DataService:
             user_obj = db_session.query(models.UserModel).filter(models.UserModel.id == user_id).first()
             if not user_obj:
                 raise HTTPException(status_code=404, detail="no user object found for given user id")
-            res_arr = user_obj.loans
+            loan_ids = [row.loan_id for row in db_session.query(models.association_table.c.loan_id)
+                        .filter(models.association_table.c.user_id == user_id)]
+            res_arr = []
+            if loan_ids:
+                res_arr = db_session.query(models.LoanModel).filter(models.LoanModel.id.in_(loan_ids)).all()
             if res_arr:
                 return {
                     "message": "loans found",
@@ -204,25 +344,53 @@ class DataService:
         :param loan_id:
         :return:
         """
-        db_session = SessionLocal()
         try:
-            loan_obj = db_session.query(self._model).filter(self._model.id == loan_id).first()
-            user_obj = db_session.query(models.UserModel).filter(models.UserModel.id == user_id).first()
+            self._write(lambda db_session: self._share_loan_in(db_session, user_id, loan_id))
+        except IntegrityError:
+            # a concurrent share of the same loan won the insert
+            pass
+
+        return {
+            "message": "loan shared",
+            "data": {
+                "loan_id": loan_id
+            },
+            "status": 200
+        }
+
+    def _share_loan_in(self, db_session, user_id, loan_id):
+        loan_obj = db_session.query(self._model.id).filter(self._model.id == loan_id).first()
+        user_obj = db_session.query(models.UserModel.id).filter(models.UserModel.id == user_id).first()
+
+        if not user_obj:
+            raise HTTPException(status_code=404, detail="user not found")
+        if not loan_obj:
+            raise HTTPException(status_code=404, detail="loan not found")
+        already_shared = db_session.query(models.association_table.c.loan_id) \
+            .filter(models.association_table.c.loan_id == loan_id,
+                    models.association_table.c.user_id == user_id).first()
+        if not already_shared:
+            db_session.execute(models.association_table.insert(), [{"user_id": user_id, "loan_id": loan_id}],
+                               bind_arguments=shard_bind_arguments(shard_router, loan_id))
+
+    def get_loan_terms(self, loan_id):
+        """
+        retrieves only the terms the schedule is computed from
+        :param loan_id:
+        :return: (amount, term_months, interest)
+        """
+        # a request pinned to the primary must not share a replica lookup that can't see its new loan yet
+        key = (loan_id, reads_pinned_to_primary())
+        return _loan_terms_flight.do(key, lambda: self._query_loan_terms(loan_id))
 
-            if not user_obj:
-                raise HTTPException(status_code=404, detail="user not found")
-            if not loan_obj:
+    def _query_loan_terms(self, loan_id):
+        db_session = SessionLocal()
+        try:
+            loan_terms = db_session.query(self._model.amount, self._model.term_months, self._model.interest) \
+                .filter(self._model.id == loan_id).first()
+            if not loan_terms:
                 raise HTTPException(status_code=404, detail="loan not found")
-            user_obj.loans.append(loan_obj)
-
-            return {
-                "message": "loan shared",
-                "data": {
-                    "loan_id": loan_obj.id
-                },
-                "status": 200
-            }
-
+            return tuple(loan_terms)
         except Exception as e:
             raise e
         finally:
@@ -234,49 +402,28 @@ class DataService:
         :param loan_id:
         :return:
         """
-        db_session = SessionLocal()
-        try:
-            loan_obj = db_session.query(self._model).filter(self._model.id == loan_id).first()
-            if not loan_obj:
-                raise HTTPException(status_code=404, detail="loan not found")
-            amount = loan_obj.amount
-            term_months = loan_obj.term_months
-            interest = loan_obj.interest
-
-            emi_result = calculate_emi(amount, term_months, interest)
-            emi_raw = emi_result.get("EMI_raw")
-            monthly_interest_rate = emi_result.get("monthly_interest_rate")
-
-            rounded_emi = round(emi_raw, 2)
-            rounded_emi_cents = int(rounded_emi * 100)
-
-            principal_cents = int(amount * 100)
-            result_list = []
-            for month in range(1, term_months + 1):
-                monthly_interest_amount_cents = int(monthly_interest_rate * principal_cents)
-                total_cents = principal_cents + monthly_interest_amount_cents
-                remaining_balance_cents = total_cents - rounded_emi_cents
-                if remaining_balance_cents < 0:
-                    rounded_emi = total_cents / 100.00
-                    remaining_balance_cents = 0
-                monthly_object = {
-                    "Month": month,
-                    "Remaining_balance": remaining_balance_cents / 100.00,
-                    "Monthly_payment": rounded_emi
-                }
-                result_list.append(monthly_object)
-                principal_cents = remaining_balance_cents
+        return self.schedule_for_terms(self.get_loan_terms(loan_id))
 
-            return {
-                "message": "monthly loan amortization schedule created",
-                "data": result_list,
-                "status": 200
-            }
+    def schedule_for_terms(self, loan_terms):
+        """
+        creates the amortization schedule response for already loaded loan terms
+        :param loan_terms: (amount, term_months, interest)
+        :return:
+        """
+        amount, term_months, interest = loan_terms
 
-        except Exception as e:
-            raise ev
-        finally:
-            db_session.close()
+        def compute():
+            with timed("schedule"):
+                return run_cpu(build_schedule, amount, term_months, interest)
+
+        result_list = get_schedule_cache().get_or_compute(
+            "schedule", cache_key("schedule", amount, term_months, interest), compute, pack_schedule, unpack_schedule)
+
+        return {
+            "message": "monthly loan amortization schedule created",
+            "data": result_list,
+            "status": 200
+        }
 
     def get_loan_summary(self, loan_id, month_val):
         """
@@ -285,49 +432,169 @@ class DataService:
         :param month_val:
         :return:
         """
+        loan_terms, loan_state = self.get_loan_servicing(loan_id)
+        return self.summary_for_servicing(loan_id, loan_terms, loan_state, month_val)
 
+    def get_loan_servicing(self, loan_id):
+        """
+        retrieves the loan terms and its servicing snapshot in one query
+        :param loan_id:
+        :return: ((amount, term_months, interest), (balance_cents, cumulative_interest_cents, last_posted_month))
+                 the snapshot is None while no payment has been posted
+        """
         db_session = SessionLocal()
         try:
-            loan_obj = db_session.query(self._model).filter(self._model.id == loan_id).first()
+            loan = self._model
+            state = models.LoanStateModel
+            row = db_session.query(loan.amount, loan.term_months, loan.interest, state.balance_cents,
+                                   state.cumulative_interest_cents, state.last_posted_month) \
+                .outerjoin(state, state.loan_id == loan.id).filter(loan.id == loan_id).first()
+            if not row:
+                raise HTTPException(status_code=404, detail="loan not found")
+            loan_state = None if row.last_posted_month is None else tuple(row[3:])
+            return tuple(row[:3]), loan_state
+        except Exception as e:
+            raise e
+        finally:
+            db_session.close()
 
+    def summary_for_servicing(self, loan_id, loan_terms, loan_state, month_val):
+        """
+        end of month summary from the payments ledger: posted months are read from the ledger, later months are
+        projected from the snapshot in closed form, loans without payments use the scheduled summary
+        :param loan_id:
+        :param loan_terms: (amount, term_months, interest)
+        :param loan_state: (balance_cents, cumulative_interest_cents, last_posted_month) or None
+        :param month_val:
+        :return:
+        """
+        if loan_state is None:
+            return self.summary_for_terms(loan_terms, month_val)
+        amount, term_months, interest = loan_terms
+        balance_cents, cumulative_interest_cents, last_posted_month = loan_state
+
+        if month_val <= last_posted_month:
+            db_session = SessionLocal()
+            try:
+                payment = db_session.query(models.PaymentModel.balance_cents,
+                                           models.PaymentModel.cumulative_interest_cents) \
+                    .filter(models.PaymentModel.loan_id == loan_id, models.PaymentModel.month == month_val).first()
+            finally:
+                db_session.close()
+            summary = {
+                "Current_Principal": payment.balance_cents / 100.00,
+                "Aggregate Amount of interest paid": payment.cumulative_interest_cents / 100.00,
+                "Aggregate Amount of principal paid": ((amount * 100) - payment.balance_cents) / 100.00
+            }
+        else:
+            with timed("summary"):
+                summary = project_summary(amount, term_months, interest, balance_cents, cumulative_interest_cents,
+                                          month_val - last_posted_month)
+        summary["Last_posted_month"] = last_posted_month
+
+        return {
+            "message": "summary as of end of month " + str(month_val),
+            "data": summary,
+            "status": 200
+        }
+
+    def post_payment(self, loan_id, amount):
+        """
+        posts the next monthly payment: charges the month's interest on the snapshot balance, applies the payment,
+        appends it to the ledger and updates the snapshot in place, independent of how many payments came before
+        :param loan_id:
+        :param amount: payment amount, anything above the balance plus interest is not taken
+        :return:
+        """
+        # the new state is computed from the one read here, a stale replica snapshot would only end in a 409
+        db_session = SessionLocal(info={"primary": True})
+        try:
+            loan_obj = db_session.query(self._model).filter(self._model.id == loan_id).first()
             if not loan_obj:
                 raise HTTPException(status_code=404, detail="loan not found")
-            term_months = loan_obj.term_months
-            amount = loan_obj.amount
-            interest = loan_obj.interest
-
-            emi_result = calculate_emi(amount, term_months, interest)
-            emi_raw = emi_result.get("EMI_raw")
-            monthly_interest_rate = emi_result.get("monthly_interest_rate")
-
-            rounded_emi = round(emi_raw, 2)
-            rounded_emi_cents = int(rounded_emi * 100)
-
-            principal_cents = int(amount * 100)
-
-            aggregate_amount_interest_paid = 0
-            for month in range(1, month_val + 1):
-                monthly_interest_amount_cents = int(monthly_interest_rate * principal_cents)
-                aggregate_amount_interest_paid += monthly_interest_amount_cents
-                total_cents = principal_cents + monthly_interest_amount_cents
-                remaining_balance_cents = total_cents - rounded_emi_cents
-                if remaining_balance_cents < 0:
-                    rounded_emi = total_cents / 100.00
-                    remaining_balance_cents = 0
-                principal_cents = remaining_balance_cents
-            aggregate_amount_principal_paid = ((amount * 100) - principal_cents) / 100.00
+            state = db_session.query(models.LoanStateModel).filter(models.LoanStateModel.loan_id == loan_id).first()
+            if state is None:
+                state = models.LoanStateModel(loan_id=loan_id, balance_cents=int(loan_obj.amount * 100),
+                                              cumulative_interest_cents=0, last_posted_month=0)
+                db_session.add(state)
+            if state.balance_cents <= 0:
+                raise HTTPException(status_code=400, detail="loan is already paid off")
+
+            monthly_interest_rate = (loan_obj.interest / 100) / 12
+            interest_cents = int(monthly_interest_rate * state.balance_cents)
+            total_cents = state.balance_cents + interest_cents
+            payment_cents = min(int(round(amount * 100)), total_cents)
+
+            state.balance_cents = total_cents - payment_cents
+            state.cumulative_interest_cents += interest_cents
+            state.last_posted_month += 1
+            payment = models.PaymentModel(loan_id=loan_id, month=state.last_posted_month,
+                                          amount_cents=payment_cents, interest_cents=interest_cents,
+                                          balance_cents=state.balance_cents,
+                                          cumulative_interest_cents=state.cumulative_interest_cents)
+            db_session.add(payment)
+            try:
+                db_session.commit()
+            except IntegrityError:
+                # another payment for this loan was posted concurrently and took the month
+                db_session.rollback()
+                raise HTTPException(status_code=409, detail="concurrent payment posted, please retry")
 
             return {
-                "message": "summary as of end of month " + str(month_val),
+                "message": "payment posted",
                 "data": {
-                    "Current_Principal": principal_cents / 100.00,
-                    "Aggregate Amount of interest paid": aggregate_amount_interest_paid / 100.00,
-                    "Aggregate Amount of principal paid": aggregate_amount_principal_paid
+                    "loan_id": loan_id,
+                    "month": payment.month,
+                    "payment": payment.amount_cents / 100.00,
+                    "interest": payment.interest_cents / 100.00,
+                    "Remaining_balance": payment.balance_cents / 100.00
                 },
                 "status": 200
             }
-
         except Exception as e:
             raise e
         finally:
             db_session.close()
+
+    def get_loan_state(self, loan_id):
+        """
+        current servicing snapshot for a loan, straight from loan_states
+        :param loan_id:
+        :return:
+        """
+        loan_terms, loan_state = self.get_loan_servicing(loan_id)
+        balance_cents, cumulative_interest_cents, last_posted_month = loan_state or (
+            int(loan_terms[0] * 100), 0, 0)
+        return {
+            "message": "loan state",
+            "data": {
+                "loan_id": loan_id,
+                "Current_Principal": balance_cents / 100.00,
+                "Aggregate Amount of interest paid": cumulative_interest_cents / 100.00,
+                "Last_posted_month": last_posted_month
+            },
+            "status": 200
+        }
+
+    def summary_for_terms(self, loan_terms, month_val):
+        """
+        creates the end of month summary response for already loaded loan terms
+        :param loan_terms: (amount, term_months, interest)
+        :param month_val:
+        :return:
+        """
+        amount, term_months, interest = loan_terms
+
+        def compute():
+            with timed("summary"):
+                return run_cpu(build_summary, amount, term_months, interest, month_val)
+
+        summary = get_schedule_cache().get_or_compute(
+            "summary", cache_key("summary", amount, term_months, interest, month_val), compute, pack_summary,
+            unpack_summary)
+
+        return {
+            "message": "summary as of end of month " + str(month_val),
+            "data": summary,
+            "status": 200
+        }
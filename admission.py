@@ -0,0 +1,155 @@
+import asyncio
+from collections import deque
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from starlette.routing import compile_path
+
+import config
+import metrics
+
+ADMISSION_REJECTED = metrics.REGISTRY.register(metrics.Counter(
+    "admission_rejected_total", "requests turned away by admission control", ("route", "reason")))
+ADMISSION_WAIT = metrics.REGISTRY.register(metrics.Histogram(
+    "admission_wait_seconds", "time admitted requests waited for a slot", ("route",)))
+
+
+def default_limits():
+    """
+    (concurrency, queue) per "METHOD route path". heavy routes are bounded, cheap lookups are not limited
+    """
+    compute = config.COMPUTE_POOL_THREADS
+    return {
+        "GET /loans/schedule/{loan_id}": (compute, compute * 8),
+        "GET /loans/summary/{loan_id}/month/{month_val}": (compute, compute * 8),
+        "POST /loans/solve": (compute, compute * 8),
+        "POST /loans/solve/batch": (max(1, compute // 2), compute),
+        # full table reads
+        "GET /users/": (2, 8),
+        "GET /loans/": (8, 32),
+    }
+
+
+def parse_limits(text):
+    """
+    :param text: "GET /users/=2:8,GET /loans/=8:32"
+    :return: {"GET /users/": (2, 8), ...}
+    """
+    limits = {}
+    for entry in text.split(","):
+        if not entry.strip():
+            continue
+        key, _, value = entry.rpartition("=")
+        concurrency, _, queue_size = value.partition(":")
+        limits[key.strip()] = (int(concurrency), int(queue_size or 0))
+    return limits
+
+
+class RouteLimiter:
+    """
+    at most `concurrency` requests of a route run at once, up to `queue_size` more wait for a slot in arrival order.
+    runs on the event loop, so plain counters are enough.
+    """
+
+    def __init__(self, method, path, concurrency, queue_size):
+        self.method = method
+        self.path = path
+        self.path_regex = compile_path(path)[0]
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.active = 0
+        self._waiters = deque()
+
+    async def acquire(self, timeout):
+        """
+        :return: None when admitted, otherwise the rejection reason: "queue_full" or "timeout"
+        """
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            return None
+        if len(self._waiters) >= self.queue_size:
+            return "queue_full"
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # release() handed over the slot in the same loop iteration the timeout fired, which 3.12+
+                # wait_for reports as a timeout. the slot is ours, refusing it would leak it
+                return None
+            return "timeout"
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # handed a slot just as the request went away
+                self.release()
+            raise
+        finally:
+            if waiter.cancelled():
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+        return None
+
+    def release(self):
+        # hand the slot straight to the oldest waiter still waiting
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class AdmissionController:
+    def __init__(self, limits):
+        limiters = []
+        for key, (concurrency, queue_size) in limits.items():
+            method, _, path = key.partition(" ")
+            limiters.append(RouteLimiter(method.upper(), path, concurrency, queue_size))
+        # literal paths before parameterised ones, as they are declared in the routers
+        self.limiters = sorted(limiters, key=lambda limiter: limiter.path.count("{"))
+
+    def limiter_for(self, request):
+        """
+        :return: the limiter of the request's route, None when the route is not limited
+        """
+        path = request.url.path
+        for limiter in self.limiters:
+            if limiter.method == request.method and limiter.path_regex.match(path):
+                return limiter
+        return None
+
+
+def create_controller():
+    limits = default_limits()
+    limits.update(parse_limits(config.ADMISSION_LIMITS))
+    return AdmissionController(limits)
+
+
+controller = create_controller()
+
+
+async def admission_middleware(request: Request, call_next):
+    """
+    applies the route's concurrency limit before the handler runs, rejecting fast instead of letting heavy
+    requests pile up behind each other and in front of cheap ones
+    """
+    limiter = controller.limiter_for(request)
+    if limiter is None:
+        return await call_next(request)
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    reason = await limiter.acquire(config.ADMISSION_QUEUE_TIMEOUT_SECONDS)
+    if reason is not None:
+        ADMISSION_REJECTED.inc(route=limiter.path, reason=reason)
+        status_code = 429 if reason == "queue_full" else 503
+        return JSONResponse({"detail": "server busy, retry later"}, status_code=status_code,
+                            headers={"Retry-After": str(config.ADMISSION_RETRY_AFTER_SECONDS)})
+    ADMISSION_WAIT.observe(loop.time() - start, route=limiter.path)
+    try:
+        return await call_next(request)
+    finally:
+        limiter.release()
@@ -0,0 +1,268 @@
+import math
+
+# bump whenever build_schedule/build_summary/project_summary output changes so cached copies and ETags are
+# invalidated
+SCHEDULE_ALGORITHM_VERSION = "2"
+
+
+def calculate_emi(amount, term_months, interest):
+    """
+    calculates the emi or monthly payment
+    :param amount:
+    :param term_months:
+    :param interest:
+    :return:
+    """
+    monthly_interest_rate = (interest / 100) / 12
+    numerator = monthly_interest_rate * math.pow((1 + monthly_interest_rate), term_months)
+    denominator = ((math.pow(1 + monthly_interest_rate, term_months)) - 1)
+
+    EMI_raw = amount * (numerator / denominator)
+    result = {
+        "EMI_raw": EMI_raw,
+        "monthly_interest_rate": monthly_interest_rate
+    }
+    return result
+
+
+def build_schedule(amount, term_months, interest):
+    """
+    builds the month by month amortization schedule for the given loan terms
+    :param amount:
+    :param term_months:
+    :param interest:
+    :return: list of monthly objects
+    """
+    emi_result = calculate_emi(amount, term_months, interest)
+    emi_raw = emi_result.get("EMI_raw")
+    monthly_interest_rate = emi_result.get("monthly_interest_rate")
+
+    rounded_emi = round(emi_raw, 2)
+    rounded_emi_cents = int(rounded_emi * 100)
+
+    principal_cents = int(amount * 100)
+    result_list = []
+    for month in range(1, term_months + 1):
+        monthly_interest_amount_cents = int(monthly_interest_rate * principal_cents)
+        total_cents = principal_cents + monthly_interest_amount_cents
+        remaining_balance_cents = total_cents - rounded_emi_cents
+        if remaining_balance_cents < 0:
+            rounded_emi = total_cents / 100.00
+            remaining_balance_cents = 0
+        monthly_object = {
+            "Month": month,
+            "Remaining_balance": remaining_balance_cents / 100.00,
+            "Monthly_payment": rounded_emi
+        }
+        result_list.append(monthly_object)
+        principal_cents = remaining_balance_cents
+    return result_list
+
+
+def _replay_cents(principal_cents, monthly_interest_rate, payment_cents, months):
+    """
+    runs the schedule's cent level months: interest truncated to the cent, the last payment only takes what is left
+    :return: (principal in cents, interest charged in cents) after the months
+    """
+    interest_cents = 0
+    for _ in range(months):
+        monthly_interest_amount_cents = int(monthly_interest_rate * principal_cents)
+        interest_cents += monthly_interest_amount_cents
+        principal_cents = max(principal_cents + monthly_interest_amount_cents - payment_cents, 0)
+    return principal_cents, interest_cents
+
+
+def build_summary(amount, term_months, interest, month_val):
+    """
+    calculates the end of month summary for the given loan terms
+    :param amount:
+    :param term_months:
+    :param interest:
+    :param month_val: month to summarize up to
+    :return: summary object
+    """
+    emi_result = calculate_emi(amount, term_months, interest)
+    emi_raw = emi_result.get("EMI_raw")
+    monthly_interest_rate = emi_result.get("monthly_interest_rate")
+
+    rounded_emi = round(emi_raw, 2)
+    rounded_emi_cents = int(rounded_emi * 100)
+
+    principal_cents, aggregate_amount_interest_paid = _replay_cents(
+        int(amount * 100), monthly_interest_rate, rounded_emi_cents, month_val)
+    aggregate_amount_principal_paid = ((amount * 100) - principal_cents) / 100.00
+
+    return {
+        "Current_Principal": principal_cents / 100.00,
+        "Aggregate Amount of interest paid": aggregate_amount_interest_paid / 100.00,
+        "Aggregate Amount of principal paid": aggregate_amount_principal_paid
+    }
+
+
+# solvers: closed forms where they exist, newton/bisection otherwise, checked against the cent level schedule
+
+MAX_SOLVER_TERM_MONTHS = 1200
+MAX_SOLVER_ITERATIONS = 60
+MAX_SCHEDULE_EVALUATIONS = 8
+MAX_SOLVER_INTEREST = 100
+
+
+class SolverError(ValueError):
+    pass
+
+
+def _check_interest(interest):
+    if not 0 <= interest <= MAX_SOLVER_INTEREST:
+        raise SolverError("interest must be between 0 and {} percent".format(MAX_SOLVER_INTEREST))
+
+
+def months_to_payoff(amount, interest, payment_cents, max_months=MAX_SOLVER_TERM_MONTHS):
+    """
+    runs the cent level schedule with a fixed payment and stops as soon as the balance is paid off
+    :param amount:
+    :param interest: yearly interest rate in percent
+    :param payment_cents: monthly payment in cents
+    :param max_months: gives up after this many months
+    :return: (months run, remaining balance in cents, last payment in cents), remaining is 0 when paid off
+    """
+    monthly_interest_rate = (interest / 100) / 12
+    principal_cents = int(amount * 100)
+    for month in range(1, max_months + 1):
+        total_cents = principal_cents + int(monthly_interest_rate * principal_cents)
+        if total_cents <= payment_cents:
+            return month, 0, total_cents
+        principal_cents = total_cents - payment_cents
+    return max_months, principal_cents, payment_cents
+
+
+def _annuity_payment(amount, term_months, monthly_interest_rate):
+    if monthly_interest_rate == 0:
+        return amount / term_months
+    return amount * monthly_interest_rate / (1 - math.pow(1 + monthly_interest_rate, -term_months))
+
+
+def solve_payment(amount, term_months, interest):
+    """
+    smallest whole cent monthly payment that pays the loan off within term_months
+    :return: (payment in cents, schedule evaluations used)
+    """
+    if amount <= 0 or term_months <= 0:
+        raise SolverError("amount and months must be positive")
+    _check_interest(interest)
+
+    def pays_off(payment_cents):
+        return months_to_payoff(amount, interest, payment_cents, max_months=term_months)[1] == 0
+
+    payment_cents = math.ceil(round(_annuity_payment(amount, term_months, (interest / 100) / 12) * 100, 6))
+    # the closed form ignores the per month truncation of interest to cents, so step a cent at a time
+    # towards the smallest payment that still pays off
+    evaluations = 1
+    if pays_off(payment_cents):
+        while evaluations < MAX_SCHEDULE_EVALUATIONS and payment_cents > 1:
+            evaluations += 1
+            if not pays_off(payment_cents - 1):
+                break
+            payment_cents -= 1
+    else:
+        while evaluations < MAX_SCHEDULE_EVALUATIONS:
+            evaluations += 1
+            payment_cents += 1
+            if pays_off(payment_cents):
+                break
+        else:
+            raise SolverError("no payment found within {} schedule evaluations".format(MAX_SCHEDULE_EVALUATIONS))
+    return payment_cents, evaluations
+
+
+def solve_term(amount, interest, payment):
+    """
+    number of months a fixed monthly payment takes to pay the loan off
+    :return: (months, final payment in cents, schedule evaluations used)
+    """
+    if amount <= 0 or payment <= 0:
+        raise SolverError("amount and payment must be positive")
+    _check_interest(interest)
+    monthly_interest_rate = (interest / 100) / 12
+    payment_cents = int(round(payment * 100))
+    if payment_cents <= int(monthly_interest_rate * int(amount * 100)):
+        raise SolverError("payment does not cover the monthly interest, the loan never pays off")
+    if monthly_interest_rate == 0:
+        estimate = math.ceil(amount / payment)
+    else:
+        # the cent check above truncates the interest, a payment within a cent of it still never pays off
+        remaining_share = 1 - monthly_interest_rate * amount / payment
+        if remaining_share <= 0:
+            raise SolverError("payment does not cover the monthly interest, the loan never pays off")
+        estimate = math.ceil(-math.log(remaining_share) / math.log(1 + monthly_interest_rate))
+    if estimate > MAX_SOLVER_TERM_MONTHS:
+        raise SolverError("loan takes longer than {} months to pay off".format(MAX_SOLVER_TERM_MONTHS))
+    # one cent level run, stopped at payoff, gives the exact month and the smaller last payment
+    months, remaining, final_payment_cents = months_to_payoff(amount, interest, payment_cents,
+                                                              max_months=estimate + 2)
+    if remaining > 0:
+        raise SolverError("loan takes longer than {} months to pay off".format(MAX_SOLVER_TERM_MONTHS))
+    return months, final_payment_cents, 1
+
+
+def solve_rate(amount, term_months, payment, tolerance=1e-12):
+    """
+    yearly interest rate at which payment pays the loan off in term_months, newton's method on the annuity
+    formula with a bisection fallback whenever a step leaves the bracket
+    :return: (yearly rate in percent, iterations used)
+    """
+    if amount <= 0 or term_months <= 0 or payment <= 0:
+        raise SolverError("amount, months and payment must be positive")
+
+    def residual(rate):
+        return _annuity_payment(amount, term_months, rate) - payment
+
+    low, high = 0.0, 1.0
+    if residual(low) > 0:
+        raise SolverError("payment is too small to repay the amount even at 0% interest")
+    if residual(low) == 0:
+        return 0.0, 0
+    if residual(high) < 0:
+        raise SolverError("payment implies a rate above 1200% a year")
+    # simple interest estimate: total interest ~ amount * rate * (months + 1) / 2
+    rate = min(max(2 * (payment * term_months - amount) / (amount * (term_months + 1)), 1e-9), high)
+    for iteration in range(1, MAX_SOLVER_ITERATIONS + 1):
+        value = residual(rate)
+        if abs(value) < tolerance:
+            return rate * 12 * 100, iteration
+        if value > 0:
+            high = rate
+        else:
+            low = rate
+        step = 1e-7 * rate
+        derivative = (residual(rate + step) - value) / step
+        candidate = rate - value / derivative if derivative > 0 else None
+        if candidate is None or not low < candidate < high:
+            candidate = (low + high) / 2
+        if abs(candidate - rate) < tolerance:
+            return candidate * 12 * 100, iteration
+        rate = candidate
+    return rate * 12 * 100, MAX_SOLVER_ITERATIONS
+
+
+def project_summary(amount, term_months, interest, balance_cents, cumulative_interest_cents, months_ahead):
+    """
+    end of month summary months_ahead scheduled payments after a known balance, replayed from the balance with
+    the schedule's cent level rules so on schedule payments project exactly what build_summary reports
+    :param amount: original loan amount
+    :param term_months:
+    :param interest:
+    :param balance_cents: balance after the last posted payment
+    :param cumulative_interest_cents: interest charged up to the last posted payment
+    :param months_ahead: scheduled payments to project
+    :return: summary object
+    """
+    emi_result = calculate_emi(amount, term_months, interest)
+    rounded_emi_cents = int(round(emi_result.get("EMI_raw"), 2) * 100)
+    principal_cents, interest_cents = _replay_cents(
+        balance_cents, emi_result.get("monthly_interest_rate"), rounded_emi_cents, months_ahead)
+
+    return {
+        "Current_Principal": principal_cents / 100.00,
+        "Aggregate Amount of interest paid": (cumulative_interest_cents + interest_cents) / 100.00,
+        "Aggregate Amount of principal paid": ((amount * 100) - principal_cents) / 100.00
+    }
@@ -0,0 +1,107 @@
+"""
+user_loans lookup latency with and without the composite primary key / reverse index.
+
+builds a throwaway sqlite database with --rows associations (default 10M), then times
+"loans of a user" and "users of a loan" lookups against both schemas.
+
+usage:
+    python benchmarks/association_lookup.py
+    python benchmarks/association_lookup.py --rows 1000000 --lookups 2000 --schema indexed
+"""
+import argparse
+import os
+import random
+import statistics
+import sqlite3
+import sys
+import tempfile
+import time
+
+SCHEMAS = {
+    # the table as it was before migration 2
+    "unindexed": [
+        "CREATE TABLE user_loans (user_id INTEGER, loan_id INTEGER)",
+    ],
+    "indexed": [
+        "CREATE TABLE user_loans (user_id INTEGER NOT NULL, loan_id INTEGER NOT NULL, "
+        "PRIMARY KEY (user_id, loan_id))",
+        "CREATE INDEX ix_user_loans_loan_id_user_id ON user_loans (loan_id, user_id)",
+    ],
+}
+
+QUERIES = {
+    "loans_of_user": "SELECT loan_id FROM user_loans WHERE user_id = ?",
+    "users_of_loan": "SELECT user_id FROM user_loans WHERE loan_id = ?",
+}
+
+
+def build(path, schema, rows, loans_per_user, chunk_size=200000):
+    """
+    fills user_loans with rows associations, each user holding loans_per_user loans and
+    each loan shared by two users on average
+    """
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=OFF")
+    connection.execute("PRAGMA synchronous=OFF")
+    for statement in SCHEMAS[schema]:
+        connection.execute(statement)
+    users = max(1, rows // loans_per_user)
+    loans = max(1, rows // 2)
+    start = time.perf_counter()
+    generated = 0
+    while generated < rows:
+        batch = []
+        for index in range(generated, min(rows, generated + chunk_size)):
+            user_id = index % users + 1
+            batch.append((user_id, (index * 7919 + user_id) % loans + 1))
+        connection.executemany("INSERT OR IGNORE INTO user_loans (user_id, loan_id) VALUES (?, ?)", batch)
+        generated += len(batch)
+    connection.commit()
+    connection.execute("ANALYZE")
+    return connection, users, loans, time.perf_counter() - start
+
+
+def time_lookups(connection, sql, key_space, lookups):
+    latencies = []
+    for _ in range(lookups):
+        key = random.randint(1, key_space)
+        start = time.perf_counter()
+        connection.execute(sql, (key,)).fetchall()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000000, help="associations to insert")
+    parser.add_argument("--loans-per-user", type=int, default=5)
+    parser.add_argument("--lookups", type=int, default=1000, help="lookups per query on the indexed schema")
+    parser.add_argument("--unindexed-lookups", type=int, default=10,
+                        help="lookups per query on the unindexed schema, each one is a full scan")
+    parser.add_argument("--schema", choices=["both", "indexed", "unindexed"], default="both")
+    args = parser.parse_args(argv)
+
+    schemas = ["unindexed", "indexed"] if args.schema == "both" else [args.schema]
+    directory = tempfile.mkdtemp()
+    for schema in schemas:
+        path = os.path.join(directory, schema + ".db")
+        connection, users, loans, build_seconds = build(path, schema, args.rows, args.loans_per_user)
+        print("{}: {} associations built in {:.1f}s, {:.0f} MB".format(
+            schema, args.rows, build_seconds, os.path.getsize(path) / 1e6))
+        lookups = args.lookups if schema == "indexed" else args.unindexed_lookups
+        for name, sql in QUERIES.items():
+            stats = time_lookups(connection, sql, users if name == "loans_of_user" else loans, lookups)
+            print("  {:<14} p50 {:>9.3f}ms  p99 {:>9.3f}ms  mean {:>9.3f}ms  ({} lookups)".format(
+                name, stats["p50_ms"], stats["p99_ms"], stats["mean_ms"], lookups))
+        connection.close()
+        os.remove(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,416 @@
+"""
+load generator: seeds users, loans and co-borrower shares through the api, then drives a weighted mix of
+requests at a target rate (open loop) or concurrency (closed loop) and reports throughput, latency
+percentiles and error rates per operation.
+
+operations: create_loan (POST /loans), share (POST /loans/share), schedule (GET /loans/schedule/{id}),
+summary (GET /loans/summary/{id}/month/{m}), user_loans (GET /users/{id}/loans), get_user (GET /users/{id}),
+list_users (GET /users)
+
+usage:
+    python benchmarks/loadgen.py --serve                                   # own uvicorn on a scratch sqlite db
+    python benchmarks/loadgen.py --serve --server-workers 4 --rps 500 --duration 60
+    python benchmarks/loadgen.py --url http://127.0.0.1:8000 --concurrency 32 --mix schedule=8,summary=2
+    python benchmarks/loadgen.py --serve --users 5000 --loans 20000 --shares 10000 --json > run.json
+
+in --rps mode latency is measured from when a request was due, not when it was sent, so a server that falls
+behind shows its queueing delay instead of hiding it (coordinated omission).
+"""
+import argparse
+import http.client
+import json
+import os
+import queue
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MIX = "create_loan=5,share=5,schedule=45,summary=30,user_loans=10,list_users=5"
+TERMS = (12, 36, 60, 120, 180, 240, 360)
+
+
+class Client:
+    """
+    keep-alive http client, one connection per thread
+    """
+
+    def __init__(self, url, timeout=30):
+        parsed = urlparse(url)
+        self._host = parsed.hostname or "127.0.0.1"
+        self._port = parsed.port or 80
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        """
+        :return: (status, parsed json body or None), status 0 when the connection failed
+        """
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        data = json.dumps(body) if body is not None else None
+        for attempt in range(2):
+            connection = getattr(self._local, "connection", None)
+            if connection is None:
+                connection = http.client.HTTPConnection(self._host, self._port, timeout=self._timeout)
+                self._local.connection = connection
+            try:
+                connection.request(method, path, body=data, headers=headers)
+                response = connection.getresponse()
+                raw = response.read()
+                try:
+                    payload = json.loads(raw) if raw else None
+                except ValueError:
+                    payload = None
+                return response.status, payload
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                self._local.connection = None
+                # a keep-alive connection the server closed fails once, retry on a fresh one
+                if attempt:
+                    return 0, None
+        return 0, None
+
+
+class Population:
+    """
+    ids created while seeding and during the run, picked with an optional skew towards the first ids
+    """
+
+    def __init__(self, skew):
+        self.user_ids = []
+        self.loans = []
+        self._skew = skew
+        self._lock = threading.Lock()
+
+    def add_user(self, user_id):
+        with self._lock:
+            self.user_ids.append(user_id)
+
+    def add_loan(self, loan_id, term_months):
+        with self._lock:
+            self.loans.append((loan_id, term_months))
+
+    def _pick(self, items, rng):
+        # skew 1 is uniform, larger values concentrate traffic on the oldest (popular) entries
+        return items[int(len(items) * rng.random() ** self._skew)]
+
+    def user(self, rng):
+        return self._pick(self.user_ids, rng)
+
+    def loan(self, rng):
+        return self._pick(self.loans, rng)
+
+
+def loan_payload(rng, user_ids):
+    return {
+        "loan_detail": {
+            "amount": rng.randrange(10000, 1000000, 500),
+            "interest": round(rng.uniform(2.0, 9.0), 2),
+            "months": rng.choice(TERMS)
+        },
+        "user_detail": {
+            "user_ids": user_ids,
+            "owner_user_id": user_ids[0]
+        }
+    }
+
+
+def op_create_loan(client, population, rng):
+    users = [population.user(rng) for _ in range(rng.choice((1, 1, 2)))]
+    payload = loan_payload(rng, sorted(set(users)))
+    status, body = client.request("POST", "/loans/", payload)
+    if status == 200 and body and body.get("data"):
+        population.add_loan(body["data"]["id"], payload["loan_detail"]["months"])
+    return status
+
+
+def op_share(client, population, rng):
+    loan_id, _ = population.loan(rng)
+    return client.request("POST", "/loans/share", {"loan_id": loan_id, "user_id": population.user(rng)})[0]
+
+
+def op_schedule(client, population, rng):
+    loan_id, _ = population.loan(rng)
+    return client.request("GET", "/loans/schedule/{}".format(loan_id))[0]
+
+
+def op_summary(client, population, rng):
+    loan_id, term_months = population.loan(rng)
+    return client.request("GET", "/loans/summary/{}/month/{}".format(loan_id, rng.randint(1, term_months)))[0]
+
+
+def op_user_loans(client, population, rng):
+    return client.request("GET", "/users/{}/loans".format(population.user(rng)))[0]
+
+
+def op_get_user(client, population, rng):
+    return client.request("GET", "/users/{}".format(population.user(rng)))[0]
+
+
+def op_list_users(client, population, rng):
+    return client.request("GET", "/users/")[0]
+
+
+OPERATIONS = {
+    "create_loan": op_create_loan,
+    "share": op_share,
+    "schedule": op_schedule,
+    "summary": op_summary,
+    "user_loans": op_user_loans,
+    "get_user": op_get_user,
+    "list_users": op_list_users,
+}
+
+
+def parse_mix(text):
+    """
+    :param text: "schedule=8,summary=2"
+    :return: (names, weights)
+    """
+    names, weights = [], []
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise SystemExit("unknown operation {}, use {}".format(name, ", ".join(OPERATIONS)))
+        names.append(name)
+        weights.append(float(weight or 1))
+    return names, weights
+
+
+def seed(client, population, users, loans, shares, concurrency, rng_seed):
+    """
+    creates users, then loans owned by random users, then extra co-borrower shares
+    """
+    run_id = uuid.uuid4().hex[:8]
+
+    def create_user(index):
+        status, body = client.request("POST", "/users/", {
+            "email": "load{}.{}@example.com".format(run_id, index), "first_name": "load", "last_name": str(index)})
+        if status == 200 and body and body.get("data"):
+            population.add_user(body["data"]["id"])
+
+    def create_loan(index):
+        op_create_loan(client, population, random.Random(rng_seed * 1000003 + index))
+
+    def share(index):
+        op_share(client, population, random.Random(rng_seed * 2000003 + index))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for step, count in ((create_user, users), (create_loan, loans), (share, shares)):
+            list(executor.map(step, range(count)))
+            if step is create_user and not population.user_ids:
+                raise SystemExit("seeding failed, no users could be created")
+    if not population.loans:
+        raise SystemExit("seeding failed, no loans could be created")
+    return time.perf_counter() - start
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.statuses = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, latency, status):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(latency)
+            self.statuses.setdefault(name, {})
+            self.statuses[name][status] = self.statuses[name].get(status, 0) + 1
+            if not 200 <= status < 300:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+
+def run_operation(client, population, recorder, names, weights, rng, due):
+    name = rng.choices(names, weights)[0]
+    try:
+        status = OPERATIONS[name](client, population, rng)
+    except Exception:
+        status = 0
+    recorder.record(name, time.perf_counter() - due, status)
+
+
+def run_closed_loop(client, population, recorder, names, weights, concurrency, duration, rng_seed):
+    deadline = time.perf_counter() + duration
+
+    def worker(index):
+        rng = random.Random(rng_seed * 7919 + index)
+        while time.perf_counter() < deadline:
+            run_operation(client, population, recorder, names, weights, rng, time.perf_counter())
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_open_loop(client, population, recorder, names, weights, rps, duration, max_workers, rng_seed):
+    due_times = queue.Queue()
+    start = time.perf_counter()
+    total = int(rps * duration)
+
+    def worker(index):
+        rng = random.Random(rng_seed * 7919 + index)
+        while True:
+            due = due_times.get()
+            if due is None:
+                return
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            run_operation(client, population, recorder, names, weights, rng, due)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(max_workers)]
+    for thread in threads:
+        thread.start()
+    # requests are due at a fixed rate whether or not earlier ones have finished
+    for index in range(total):
+        due = start + index / rps
+        delay = due - time.perf_counter() - 0.05
+        if delay > 0:
+            time.sleep(delay)
+        due_times.put(due)
+    for _ in threads:
+        due_times.put(None)
+    for thread in threads:
+        thread.join()
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def summarize(recorder, elapsed):
+    def stats(latencies, errors):
+        latencies = sorted(latencies)
+        return {
+            "requests": len(latencies),
+            "throughput_rps": len(latencies) / elapsed,
+            "error_rate": errors / len(latencies),
+            "mean_ms": statistics.fmean(latencies) * 1000,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p90_ms": percentile(latencies, 0.90) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "max_ms": latencies[-1] * 1000,
+        }
+
+    report = {"elapsed_seconds": elapsed, "operations": {}}
+    all_latencies = []
+    for name, latencies in sorted(recorder.latencies.items()):
+        report["operations"][name] = stats(latencies, recorder.errors.get(name, 0))
+        report["operations"][name]["statuses"] = {str(status): count for status, count in
+                                                  sorted(recorder.statuses[name].items())}
+        all_latencies.extend(latencies)
+    if all_latencies:
+        report["total"] = stats(all_latencies, sum(recorder.errors.values()))
+    return report
+
+
+def print_report(report):
+    print("{:<12} {:>8} {:>9} {:>7} {:>9} {:>9} {:>9} {:>9}".format(
+        "operation", "requests", "rps", "errors", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+    rows = list(report["operations"].items())
+    if "total" in report:
+        rows.append(("total", report["total"]))
+    for name, stats in rows:
+        print("{:<12} {:>8} {:>9.1f} {:>6.2f}% {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+            name, stats["requests"], stats["throughput_rps"], stats["error_rate"] * 100, stats["p50_ms"],
+            stats["p90_ms"], stats["p99_ms"], stats["max_ms"]))
+
+
+def start_server(port, workers, database_path):
+    """
+    migrates a scratch sqlite database and starts uvicorn on it, returns once /health/ready answers
+    """
+    env = dict(os.environ, DATABASE_URL="sqlite:///" + database_path)
+    env.pop("SHARD_URLS", None)
+    env.pop("DATABASE_REPLICA_URLS", None)
+    subprocess.run([sys.executable, "manage.py", "migrate"], cwd=REPO_ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers",
+                               str(workers), "--log-level", "warning", "--no-access-log"], cwd=REPO_ROOT, env=env)
+    client = Client("http://127.0.0.1:{}".format(port), timeout=2)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit("uvicorn exited with {}".format(server.returncode))
+        if client.request("GET", "/health/ready")[0] == 200:
+            return server
+        time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("server did not become ready")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="server to load, ignored with --serve")
+    parser.add_argument("--serve", action="store_true", help="start uvicorn on a scratch sqlite database")
+    parser.add_argument("--port", type=int, default=8765, help="port for --serve")
+    parser.add_argument("--server-workers", type=int, default=1, help="uvicorn workers for --serve")
+    parser.add_argument("--users", type=int, default=200, help="users to seed")
+    parser.add_argument("--loans", type=int, default=1000, help="loans to seed")
+    parser.add_argument("--shares", type=int, default=500, help="extra co-borrower shares to seed")
+    parser.add_argument("--seed-concurrency", type=int, default=16)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operation=weight list")
+    parser.add_argument("--skew", type=float, default=1.0,
+                        help="1 picks loans and users uniformly, larger values concentrate on popular ones")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--rps", type=float, help="open loop: requests started per second")
+    mode.add_argument("--concurrency", type=int, default=16, help="closed loop: requests in flight")
+    parser.add_argument("--max-workers", type=int, default=256, help="threads sending requests in --rps mode")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load after seeding")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args(argv)
+
+    names, weights = parse_mix(args.mix)
+    server = None
+    if args.serve:
+        database_path = os.path.join(tempfile.mkdtemp(), "loadgen.db")
+        server = start_server(args.port, args.server_workers, database_path)
+        args.url = "http://127.0.0.1:{}".format(args.port)
+    try:
+        client = Client(args.url)
+        population = Population(args.skew)
+        seed_seconds = seed(client, population, args.users, args.loans, args.shares, args.seed_concurrency,
+                            args.seed)
+        print("seeded {} users, {} loans, {} shares in {:.1f}s".format(
+            len(population.user_ids), len(population.loans), args.shares, seed_seconds), file=sys.stderr)
+
+        recorder = Recorder()
+        start = time.perf_counter()
+        if args.rps:
+            run_open_loop(client, population, recorder, names, weights, args.rps, args.duration, args.max_workers,
+                          args.seed)
+        else:
+            run_closed_loop(client, population, recorder, names, weights, args.concurrency, args.duration,
+                            args.seed)
+        report = summarize(recorder, time.perf_counter() - start)
+        report["config"] = {"mode": "rps" if args.rps else "concurrency", "rps": args.rps,
+                            "concurrency": None if args.rps else args.concurrency, "mix": args.mix,
+                            "skew": args.skew, "users": args.users, "loans": args.loans, "shares": args.shares}
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 1 if not report["operations"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
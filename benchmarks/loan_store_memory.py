@@ -0,0 +1,79 @@
+"""
+memory per loan for ORM objects, row dicts and the compact LoanStore.
+
+builds --loans synthetic loans in each representation under tracemalloc and extrapolates
+to --target loans (default 10M).
+
+usage:
+    python benchmarks/loan_store_memory.py
+    python benchmarks/loan_store_memory.py --loans 1000000 --target 10000000
+"""
+import argparse
+import os
+import sys
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import models  # noqa: E402
+from loan_store import LoanLinks, LoanStore  # noqa: E402
+
+
+def synthetic_loans(count):
+    for loan_id in range(1, count + 1):
+        yield loan_id, 1000.0 + (loan_id % 5000) * 100, 3.0 + (loan_id % 40) / 10, 12 * (1 + loan_id % 30), \
+            1 + loan_id // 3
+
+
+def build_orm(count):
+    return [models.LoanModel(id=loan_id, amount=amount, interest=interest, term_months=term_months,
+                             owner_user_id=owner) for loan_id, amount, interest, term_months, owner in
+            synthetic_loans(count)]
+
+
+def build_dicts(count):
+    return [{"id": loan_id, "amount": amount, "interest": interest, "term_months": term_months,
+             "owner_user_id": owner} for loan_id, amount, interest, term_months, owner in synthetic_loans(count)]
+
+
+def build_store(count):
+    store = LoanStore()
+    for row in synthetic_loans(count):
+        store.append(*row)
+    return store
+
+
+def build_links(count):
+    # every loan shared by its owner and one co-borrower
+    pairs = sorted((user_id, loan_id) for loan_id, _, _, _, owner in synthetic_loans(count)
+                   for user_id in (owner, owner + 1))
+    return LoanLinks(pairs, sorted((loan_id, user_id) for user_id, loan_id in pairs))
+
+
+def measure(build, count):
+    tracemalloc.start()
+    value = build(count)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del value
+    return current
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loans", type=int, default=200000, help="loans built per representation")
+    parser.add_argument("--target", type=int, default=10000000, help="working set size to extrapolate to")
+    args = parser.parse_args(argv)
+
+    for name, build in (("orm objects", build_orm), ("row dicts", build_dicts), ("loan store", build_store),
+                        ("user<->loan links", build_links)):
+        used = measure(build, args.loans)
+        per_loan = used / args.loans
+        print("{:<18} {:>8.1f} bytes/loan  {:>10.0f} MB for {} loans".format(
+            name, per_loan, per_loan * args.target / 1e6, args.target))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+startup time benchmark: imports the app in fresh interpreters with -X importtime and reports the boot cost.
+
+usage:
+    python benchmarks/startup_bench.py                      # report
+    python benchmarks/startup_bench.py --json > boot.json   # save a baseline
+    python benchmarks/startup_bench.py --baseline boot.json --max-regression 0.2
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_importtime(stderr):
+    """
+    parses -X importtime output
+    :param stderr: text written by the interpreter
+    :return: {module: (self_us, cumulative_us, depth)}
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return modules
+
+
+def measure_once(module):
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                               cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+    wall = time.perf_counter() - start
+    return wall, parse_importtime(completed.stderr)
+
+
+def run(module, runs):
+    walls = []
+    imports = []
+    for _ in range(runs):
+        wall, modules = measure_once(module)
+        walls.append(wall)
+        imports.append(modules)
+    last = imports[-1]
+    top = sorted(((name, timings[0]) for name, timings in last.items()), key=lambda item: item[1], reverse=True)
+    return {
+        "module": module,
+        "runs": runs,
+        "wall_seconds_median": statistics.median(walls),
+        "import_seconds_median": statistics.median(modules[module][1] for modules in imports) / 1e6,
+        "modules_imported": len(last),
+        "top_self_us": top[:15]
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main", help="module to import, default main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    parser.add_argument("--baseline", help="json report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="allowed relative slowdown of the import time against the baseline")
+    args = parser.parse_args(argv)
+
+    report = run(args.module, args.runs)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print("module:              {}".format(report["module"]))
+        print("interpreter + import {:.3f}s (median of {})".format(report["wall_seconds_median"], args.runs))
+        print("import only          {:.3f}s".format(report["import_seconds_median"]))
+        print("modules imported     {}".format(report["modules_imported"]))
+        print("slowest modules (self time):")
+        for name, self_us in report["top_self_us"]:
+            print("  {:>8.1f}ms  {}".format(self_us / 1000, name))
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        limit = baseline["import_seconds_median"] * (1 + args.max_regression)
+        if report["import_seconds_median"] > limit:
+            print("import time regressed: {:.3f}s > {:.3f}s allowed".format(report["import_seconds_median"], limit),
+                  file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
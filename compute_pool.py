@@ -0,0 +1,65 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import config
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _executor(kind):
+    executor = _executors.get(kind)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(kind)
+            if executor is None:
+                if kind == "threads":
+                    executor = ThreadPoolExecutor(max_workers=config.COMPUTE_POOL_THREADS,
+                                                  thread_name_prefix="compute")
+                else:
+                    executor = ProcessPoolExecutor(max_workers=config.COMPUTE_POOL_PROCESSES)
+                _executors[kind] = executor
+    return executor
+
+
+async def run_in_compute_pool(func, *args, **kwargs):
+    """
+    runs a sync function on the compute threads, with the caller's context variables (request stats,
+    read consistency, active profiles) copied over
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _executor("threads"), functools.partial(context.run, func, *args, **kwargs))
+
+
+def compute_bound(func):
+    """
+    decorator for cpu heavy sync route handlers: the handler runs on the compute pool instead of the shared
+    threadpool, so a burst of them can't take the threads cheap handlers need. put it above @profiled.
+    :param func: sync route handler
+    :return: async handler with the same signature
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_in_compute_pool(func, *args, **kwargs)
+    return wrapper
+
+
+def run_cpu(func, *args):
+    """
+    runs pure computation in the compute processes when COMPUTE_POOL_PROCESSES is set, inline otherwise.
+    func and its arguments must be picklable.
+    """
+    if config.COMPUTE_POOL_PROCESSES <= 0:
+        return func(*args)
+    return _executor("processes").submit(func, *args).result()
+
+
+def shutdown():
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        _executors.clear()
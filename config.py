@@ -0,0 +1,79 @@
+import os
+
+# runtime settings, all overridable through environment variables
+
+
+def _env_bool(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# emit a Server-Timing header (app, db and schedule timings) on every response
+SERVER_TIMING_ENABLED = _env_bool("SERVER_TIMING_ENABLED")
+
+# per request profiling, only active when enabled here and the request carries the X-Profile header
+PROFILING_ENABLED = _env_bool("PROFILING_ENABLED")
+# when set, profiled requests must also send a matching X-Profile-Token header
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "./profiles")
+
+# max-age sent with schedule and summary responses, clients revalidate with If-None-Match afterwards
+SCHEDULE_CACHE_MAX_AGE = int(os.environ.get("SCHEDULE_CACHE_MAX_AGE", "300"))
+
+# computed schedule/summary cache: none, memory (per worker), sqlite (file shared by every worker on the host)
+# or redis (shared across hosts)
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory")
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "10000"))
+CACHE_TTL_SECONDS = float(os.environ.get("CACHE_TTL_SECONDS", "86400"))
+CACHE_SQLITE_PATH = os.environ.get("CACHE_SQLITE_PATH", "./schedule_cache.db")
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL", "redis://127.0.0.1:6379/0")
+
+# startup warm-up: precompute schedules for the listed loan ids, or else for the most common loan term tuples
+WARMUP_ENABLED = _env_bool("WARMUP_ENABLED", True)
+WARMUP_LOAN_IDS = [int(loan_id) for loan_id in os.environ.get("WARMUP_LOAN_IDS", "").split(",") if loan_id.strip()]
+WARMUP_TOP_TERMS = int(os.environ.get("WARMUP_TOP_TERMS", "100"))
+
+# primary database and optional read replicas (comma separated urls)
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./sql_app.db")
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# after a write, reads from the same client go to the primary for this long
+READ_YOUR_WRITES_SECONDS = float(os.environ.get("READ_YOUR_WRITES_SECONDS", "5"))
+
+# horizontal sharding: comma separated database urls, users and loans are spread across them by hashed id.
+# takes precedence over DATABASE_URL and DATABASE_REPLICA_URLS
+SHARD_URLS = [url.strip() for url in os.environ.get("SHARD_URLS", "").split(",") if url.strip()]
+
+# background jobs: state in a sqlite file, results on disk, run by a thread or process pool
+JOBS_DB_PATH = os.environ.get("JOBS_DB_PATH", "./jobs.db")
+JOB_RESULT_DIR = os.environ.get("JOB_RESULT_DIR", "./job_results")
+JOB_EXECUTOR = os.environ.get("JOB_EXECUTOR", "thread")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+# submissions beyond this many queued or running jobs are rejected
+JOB_MAX_PENDING = int(os.environ.get("JOB_MAX_PENDING", "100"))
+
+# sqlite files are opened in WAL mode with synchronous=NORMAL: readers don't block the writer and commits
+# skip the per transaction fsync (a power loss can drop the last commits, never corrupt the file)
+SQLITE_WAL_ENABLED = _env_bool("SQLITE_WAL_ENABLED", True)
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# group commit: concurrent user, loan and share writes are collected for up to WRITE_BATCH_WINDOW_MS
+# (at most WRITE_BATCH_MAX_SIZE of them) and committed as one transaction
+WRITE_BATCH_ENABLED = _env_bool("WRITE_BATCH_ENABLED", False)
+WRITE_BATCH_WINDOW_MS = float(os.environ.get("WRITE_BATCH_WINDOW_MS", "2"))
+WRITE_BATCH_MAX_SIZE = int(os.environ.get("WRITE_BATCH_MAX_SIZE", "100"))
+
+# cpu heavy handlers (schedule, summary, solvers) run on their own pool of this many threads instead of the
+# shared threadpool. with COMPUTE_POOL_PROCESSES > 0 the amortization math itself runs in that many processes
+COMPUTE_POOL_THREADS = int(os.environ.get("COMPUTE_POOL_THREADS", "4"))
+COMPUTE_POOL_PROCESSES = int(os.environ.get("COMPUTE_POOL_PROCESSES", "0"))
+
+# admission control: per route concurrency limits with a bounded wait queue. a full queue is rejected with 429,
+# a request that waited ADMISSION_QUEUE_TIMEOUT_SECONDS without a slot with 503, both with Retry-After.
+# ADMISSION_LIMITS overrides the defaults in admission.py, e.g. "GET /users/=2:8,GET /loans/=8:32"
+# (method and route path = concurrency:queue)
+ADMISSION_ENABLED = _env_bool("ADMISSION_ENABLED", True)
+ADMISSION_LIMITS = os.environ.get("ADMISSION_LIMITS", "")
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT_SECONDS", "2"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.environ.get("ADMISSION_RETRY_AFTER_SECONDS", "1"))
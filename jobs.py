@@ -0,0 +1,305 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import config
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+EXPORT_PAGE_SIZE = 500
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobStore:
+    """
+    job state in a sqlite file, shared by every api worker and job worker process on the host
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, type TEXT NOT NULL, params TEXT NOT NULL, status TEXT NOT NULL, "
+                "progress REAL NOT NULL DEFAULT 0, error TEXT, result_path TEXT, "
+                "cancel_requested INTEGER NOT NULL DEFAULT 0, worker_pid INTEGER, "
+                "created_at REAL NOT NULL, started_at REAL, finished_at REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs (status)")
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=10)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def create(self, job_type, params):
+        job_id = uuid.uuid4().hex
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, type, params, status, worker_pid, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, job_type, json.dumps(params), QUEUED, os.getpid(), time.time()))
+        return job_id
+
+    def get(self, job_id):
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def update(self, job_id, **fields):
+        assignments = ", ".join("{} = ?".format(name) for name in fields)
+        with self._connection() as connection:
+            connection.execute("UPDATE jobs SET " + assignments + " WHERE id = ?", tuple(fields.values()) + (job_id,))
+
+    def start(self, job_id):
+        """
+        moves a queued job to running, unless it was cancelled while waiting
+        :return: boolean, True when the job should run
+        """
+        with self._connection() as connection:
+            updated = connection.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, worker_pid = ? "
+                "WHERE id = ? AND status = ? AND cancel_requested = 0",
+                (RUNNING, time.time(), os.getpid(), job_id, QUEUED))
+        return updated.rowcount == 1
+
+    def request_cancel(self, job_id):
+        with self._connection() as connection:
+            connection.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+            connection.execute("UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+                               (CANCELLED, time.time(), job_id, QUEUED))
+
+    def cancel_requested(self, job_id):
+        row = self._connection().execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def pending_count(self):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchone()[0]
+
+    def fail_orphaned(self):
+        """
+        marks jobs whose worker process died (e.g. a restart) as failed so they don't look pending forever
+        """
+        rows = self._connection().execute(
+            "SELECT id, worker_pid FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchall()
+        for row in rows:
+            if not _pid_alive(row["worker_pid"]):
+                self.update(row["id"], status=FAILED, error="interrupted, worker process exited",
+                            finished_at=time.time())
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobContext:
+    """
+    handed to job functions to report progress and notice cancellation
+    """
+
+    def __init__(self, store, job_id):
+        self._store = store
+        self._job_id = job_id
+
+    def progress(self, fraction):
+        self._store.update(self._job_id, progress=min(max(fraction, 0.0), 1.0))
+
+    def check_cancelled(self):
+        if self._store.cancel_requested(self._job_id):
+            raise JobCancelled()
+
+
+def _iter_loan_pages(filters, context):
+    """
+    yields pages of matching loans as LoanStores, loaded with core selects rather than ORM objects
+    """
+    import models
+    from DataService.data_service import DataService
+
+    data_service = DataService(models.LoanModel)
+    total = data_service.count_loans(filters) or 1
+    done = 0
+    after_id = None
+    while True:
+        context.check_cancelled()
+        store = data_service.loan_store(filters, after_id=after_id, limit=EXPORT_PAGE_SIZE)
+        yield store
+        done += len(store)
+        context.progress(done / total)
+        if len(store) < EXPORT_PAGE_SIZE:
+            return
+        after_id = store.ids[-1]
+
+
+def run_schedule_export(params, context, result_file):
+    """
+    writes every matching loan's schedule as one json line per loan.
+    schedules are computed right here on the job worker, not through the schedule cache or the request compute
+    pool, so a bulk export neither evicts the entries the api requests are hitting nor queues in front of them
+    params: loan_ids and/or the GET /loans filters
+    """
+    from amortization import build_schedule
+
+    filters = dict(params.get("filters") or {}, loan_ids=params.get("loan_ids"))
+    exported = 0
+    for loans in _iter_loan_pages(filters, context):
+        for loan in loans:
+            schedule = build_schedule(*loan.terms)
+            result_file.write(json.dumps({"loan_id": loan.id, "schedule": schedule}) + "\n")
+            exported += 1
+    return {"loans": exported}
+
+
+def run_portfolio_summary(params, context, result_file):
+    """
+    totals the scheduled end of month summaries of every matching loan, computed on the job worker like the export
+    params: month (required), loan_ids and/or the GET /loans filters
+    """
+    from amortization import build_summary
+
+    month_val = int(params["month"])
+    filters = dict(params.get("filters") or {}, loan_ids=params.get("loan_ids"))
+    totals = {
+        "month": month_val,
+        "loans": 0,
+        "Original_amount": 0.0,
+        "Current_Principal": 0.0,
+        "Aggregate Amount of interest paid": 0.0,
+        "Aggregate Amount of principal paid": 0.0
+    }
+    for loans in _iter_loan_pages(filters, context):
+        for loan in loans:
+            summary = build_summary(*loan.terms, min(month_val, loan.term_months))
+            totals["loans"] += 1
+            totals["Original_amount"] += loan.amount
+            for key in ("Current_Principal", "Aggregate Amount of interest paid",
+                        "Aggregate Amount of principal paid"):
+                totals[key] += summary[key]
+    for key, value in totals.items():
+        if isinstance(value, float):
+            totals[key] = round(value, 2)
+    json.dump(totals, result_file)
+    return {"loans": totals["loans"]}
+
+
+# job type -> (function, result file extension)
+JOB_TYPES = {
+    "schedule_export": (run_schedule_export, ".jsonl"),
+    "portfolio_summary": (run_portfolio_summary, ".json"),
+}
+
+
+def execute_job(job_id, db_path, result_dir):
+    """
+    runs one job inside a pool worker, module level so process pools can pickle it
+    """
+    store = JobStore(db_path)
+    if not store.start(job_id):
+        return
+    job = store.get(job_id)
+    function, extension = JOB_TYPES[job["type"]]
+    os.makedirs(result_dir, exist_ok=True)
+    result_path = os.path.join(result_dir, job_id + extension)
+    partial_path = result_path + ".partial"
+    try:
+        with open(partial_path, "w") as result_file:
+            function(json.loads(job["params"]), JobContext(store, job_id), result_file)
+        os.replace(partial_path, result_path)
+        store.update(job_id, status=SUCCEEDED, progress=1.0, result_path=result_path, finished_at=time.time())
+    except JobCancelled:
+        store.update(job_id, status=CANCELLED, finished_at=time.time())
+    except Exception as e:
+        store.update(job_id, status=FAILED, error=str(e) or e.__class__.__name__, finished_at=time.time())
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+
+class JobManager:
+    """
+    submits jobs to a bounded worker pool, jobs never run on the request workers
+    """
+
+    def __init__(self, db_path, result_dir, workers=2, executor="thread", max_pending=100):
+        self.store = JobStore(db_path)
+        self.store.fail_orphaned()
+        self._db_path = db_path
+        self._result_dir = result_dir
+        self._max_pending = max_pending
+        executor_class = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+        self._executor = executor_class(max_workers=workers)
+        self._futures = {}
+
+    def submit(self, job_type, params):
+        """
+        :return: job id, or None when too many jobs are pending
+        """
+        if job_type not in JOB_TYPES:
+            raise ValueError("unknown job type " + str(job_type))
+        if self.store.pending_count() >= self._max_pending:
+            return None
+        job_id = self.store.create(job_type, params)
+        future = self._executor.submit(execute_job, job_id, self._db_path, self._result_dir)
+        self._futures[job_id] = future
+        future.add_done_callback(lambda _: self._futures.pop(job_id, None))
+        return job_id
+
+    def cancel(self, job_id):
+        self.store.request_cancel(job_id)
+        future = self._futures.get(job_id)
+        if future is not None:
+            future.cancel()
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """
+    process wide job manager, created on first use so api workers that never see a job pay nothing
+    """
+    global _job_manager
+    if _job_manager is None:
+        with _job_manager_lock:
+            if _job_manager is None:
+                _job_manager = JobManager(config.JOBS_DB_PATH, config.JOB_RESULT_DIR, workers=config.JOB_WORKERS,
+                                          executor=config.JOB_EXECUTOR, max_pending=config.JOB_MAX_PENDING)
+    return _job_manager
+
+
+def shutdown_job_manager():
+    """
+    stops handing out queued jobs, running ones are left to finish or be failed as orphans on the next start
+    """
+    global _job_manager
+    with _job_manager_lock:
+        if _job_manager is not None:
+            _job_manager.shutdown()
+            _job_manager = None
@@ -0,0 +1,197 @@
+import heapq
+from array import array
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from sqlalchemy import select
+
+import models
+
+
+class LoanRecord:
+    """
+    one loan read out of a LoanStore, same attribute names as LoanModel
+    """
+
+    __slots__ = ("id", "amount_cents", "interest", "term_months", "owner_user_id")
+
+    def __init__(self, loan_id, amount_cents, interest, term_months, owner_user_id):
+        self.id = loan_id
+        self.amount_cents = amount_cents
+        self.interest = interest
+        self.term_months = term_months
+        self.owner_user_id = owner_user_id
+
+    @property
+    def amount(self):
+        return self.amount_cents / 100.00
+
+    @property
+    def terms(self):
+        return self.amount, self.term_months, self.interest
+
+
+class LoanStore:
+    """
+    loans as parallel typed arrays ordered by id, 36 bytes a loan instead of an ORM object per loan.
+    rows must be appended in ascending id order, lookups by id are a binary search.
+    """
+
+    def __init__(self):
+        self.ids = array("q")
+        self.amount_cents = array("q")
+        self.interest = array("d")
+        self.term_months = array("i")
+        # 0 when the loan has no owner
+        self.owner_user_ids = array("q")
+
+    def append(self, loan_id, amount, interest, term_months, owner_user_id):
+        if self.ids and loan_id <= self.ids[-1]:
+            raise ValueError("loans must be appended in ascending id order")
+        self.ids.append(loan_id)
+        self.amount_cents.append(round(amount * 100))
+        self.interest.append(interest)
+        self.term_months.append(term_months)
+        self.owner_user_ids.append(owner_user_id or 0)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, loan_id):
+        """
+        :return: index of the loan in the arrays, or -1
+        """
+        index = bisect_left(self.ids, loan_id)
+        if index < len(self.ids) and self.ids[index] == loan_id:
+            return index
+        return -1
+
+    def record(self, index):
+        return LoanRecord(self.ids[index], self.amount_cents[index], self.interest[index], self.term_months[index],
+                          self.owner_user_ids[index] or None)
+
+    def get(self, loan_id):
+        index = self.position(loan_id)
+        return self.record(index) if index >= 0 else None
+
+    def terms(self, index):
+        """
+        (amount, term_months, interest) as taken by the schedule and summary code
+        """
+        return self.amount_cents[index] / 100.00, self.term_months[index], self.interest[index]
+
+    def __iter__(self):
+        for index in range(len(self.ids)):
+            yield self.record(index)
+
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in
+                   (self.ids, self.amount_cents, self.interest, self.term_months, self.owner_user_ids))
+
+
+def _build_csr(pairs):
+    """
+    compressed sparse rows from (key, value) pairs sorted by key
+    :return: (keys, offsets, values), the values of keys[i] are values[offsets[i]:offsets[i + 1]]
+    """
+    keys = array("q")
+    offsets = array("q")
+    values = array("q")
+    for key, value in pairs:
+        if not keys or keys[-1] != key:
+            keys.append(key)
+            offsets.append(len(values))
+        values.append(value)
+    offsets.append(len(values))
+    return keys, offsets, values
+
+
+def _csr_lookup(keys, offsets, values, key):
+    index = bisect_left(keys, key)
+    if index < len(keys) and keys[index] == key:
+        return values[offsets[index]:offsets[index + 1]]
+    return array("q")
+
+
+class LoanLinks:
+    """
+    user <-> loan links from user_loans in both directions as CSR arrays, 8 bytes per link and direction
+    """
+
+    def __init__(self, user_loan_pairs, loan_user_pairs):
+        """
+        :param user_loan_pairs: (user_id, loan_id) sorted by user_id
+        :param loan_user_pairs: (loan_id, user_id) sorted by loan_id
+        """
+        self.user_ids, self.user_offsets, self.user_loan_ids = _build_csr(user_loan_pairs)
+        self.loan_ids, self.loan_offsets, self.loan_user_ids = _build_csr(loan_user_pairs)
+
+    def loans_for_user(self, user_id):
+        return _csr_lookup(self.user_ids, self.user_offsets, self.user_loan_ids, user_id)
+
+    def users_for_loan(self, loan_id):
+        return _csr_lookup(self.loan_ids, self.loan_offsets, self.loan_user_ids, loan_id)
+
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in
+                   (self.user_ids, self.user_offsets, self.user_loan_ids,
+                    self.loan_ids, self.loan_offsets, self.loan_user_ids))
+
+
+def _merged_rows(engines, statement, sort_key, batch_size):
+    """
+    streams the statement from every engine (one per shard) and merges the per engine orderings
+    """
+    with ExitStack() as stack:
+        streams = []
+        for engine in engines:
+            connection = stack.enter_context(engine.connect())
+            streams.append(connection.execution_options(yield_per=batch_size).execute(statement))
+        if len(streams) == 1:
+            yield from streams[0]
+        else:
+            yield from heapq.merge(*streams, key=sort_key)
+
+
+def load_loan_store(engines, criteria=(), after_id=None, limit=None, batch_size=50000):
+    """
+    bulk loads loans with core selects, no ORM objects are created
+    :param engines: the primary, or every shard
+    :param criteria: where clauses on LoanModel columns
+    :param after_id: only loans with a larger id
+    :param limit: at most this many loans, lowest ids first
+    :param batch_size: rows fetched per round trip
+    :return: LoanStore
+    """
+    loan = models.LoanModel
+    criteria = list(criteria)
+    if after_id is not None:
+        criteria.append(loan.id > after_id)
+    statement = select(loan.id, loan.amount, loan.interest, loan.term_months, loan.owner_user_id) \
+        .where(*criteria).order_by(loan.id)
+    if limit is not None:
+        statement = statement.limit(limit)
+
+    store = LoanStore()
+    rows = _merged_rows(engines, statement, lambda row: row[0], batch_size)
+    try:
+        for row in rows:
+            if limit is not None and len(store) >= limit:
+                break
+            store.append(*row)
+    finally:
+        rows.close()
+    return store
+
+
+def load_loan_links(engines, batch_size=50000):
+    """
+    bulk loads user_loans in both directions, each read in the order of its index so nothing is sorted here
+    :param engines: the primary, or every shard
+    :return: LoanLinks
+    """
+    table = models.association_table
+    by_user = select(table.c.user_id, table.c.loan_id).order_by(table.c.user_id, table.c.loan_id)
+    by_loan = select(table.c.loan_id, table.c.user_id).order_by(table.c.loan_id, table.c.user_id)
+    return LoanLinks(_merged_rows(engines, by_user, lambda row: tuple(row), batch_size),
+                     _merged_rows(engines, by_loan, lambda row: tuple(row), batch_size))
@@ -1,17 +1,94 @@
-import models
-from fastapi import FastAPI
-from database import engine
+import time
+from contextlib import asynccontextmanager
 
-from routers import users, loans
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 
-app = FastAPI()
+import admission
+import compute_pool
+import config
+import database
+import jobs as job_queue
+import metrics
+import profiling
+import warmup
+from routers import users, loans, health, jobs
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    startup: warm the schedule cache in the background, /health/ready stays 503 until the warm-up is done.
+    the schema is not touched here, run python manage.py migrate before starting workers
+    """
+    warmup.start_warmup()
+    yield
+    job_queue.shutdown_job_manager()
+    compute_pool.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(users.router)
 app.include_router(loans.router)
-models.Base.metadata.create_all(bind=engine)
+app.include_router(health.router)
+app.include_router(jobs.router)
+
+# registered before the metrics middleware so it runs inside it and rejected requests are still counted
+if config.ADMISSION_ENABLED:
+    app.middleware("http")(admission.admission_middleware)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """
+    records per route latency and db query counts, optionally emits a Server-Timing header
+    """
+    stats = metrics.start_request()
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+
+    route = request.scope.get("route")
+    route_path = route.path if route is not None else "unmatched"
+    metrics.REQUEST_LATENCY.observe(elapsed, method=request.method, route=route_path,
+                                    status=response.status_code)
+    metrics.DB_QUERIES_PER_REQUEST.observe(stats.db_queries, route=route_path)
+    if config.SERVER_TIMING_ENABLED:
+        response.headers["Server-Timing"] = metrics.server_timing_header(stats, elapsed)
+    return response
+
+
+READ_YOUR_WRITES_COOKIE = "db_primary_until"
+
+if database.replica_engines:
+    @app.middleware("http")
+    async def read_your_writes(request: Request, call_next):
+        """
+        keeps a client's reads on the primary for a short while after it wrote, tracked in a cookie
+        """
+        primary_until = database.parse_primary_until(request.cookies.get(READ_YOUR_WRITES_COOKIE))
+        consistency = database.start_read_consistency(primary_until)
+        response = await call_next(request)
+        if consistency.primary_until > primary_until:
+            response.set_cookie(READ_YOUR_WRITES_COOKIE, repr(consistency.primary_until),
+                                max_age=int(config.READ_YOUR_WRITES_SECONDS) + 1, httponly=True)
+        return response
+
+
+if config.PROFILING_ENABLED:
+    app.middleware("http")(profiling.profile_request_middleware)
 
 
 @app.get("/")
 def homepage():
     return {
         "Welcome to loan amortization app"
-}
\ No newline at end of file
+}
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """
+    prometheus scrape endpoint
+    """
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
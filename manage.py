@@ -0,0 +1,42 @@
+import argparse
+import sys
+
+
+def migrate(args):
+    from database import engine, shard_engines
+    from migrations import migrate as run_migrations
+
+    if shard_engines:
+        from sharding import allocator_metadata
+
+        allocator_metadata.create_all(bind=engine)
+    for index, shard_engine in enumerate(shard_engines or [engine]):
+        applied = run_migrations(shard_engine)
+        prefix = "shard {}: ".format(index) if shard_engines else ""
+        if applied:
+            print(prefix + "applied migrations: " + ", ".join(str(version) for version in applied))
+        else:
+            print(prefix + "schema up to date")
+    if shard_engines:
+        from sharding import backfill_user_emails
+
+        added = backfill_user_emails(shard_engines)
+        if added:
+            print("added {} existing user emails to user_emails".format(added))
+
+
+def main(argv=None):
+    """
+    operational commands that should not run inside the web workers
+    usage: python manage.py migrate
+    """
+    parser = argparse.ArgumentParser(description="loan amortization app management")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("migrate", help="create or upgrade the database schema").set_defaults(func=migrate)
+    args = parser.parse_args(argv)
+    args.func(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
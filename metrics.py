@@ -0,0 +1,229 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+# prometheus default latency buckets (seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+def _format_labels(label_names, label_values):
+    if not label_names:
+        return ""
+    pairs = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+             for name, value in zip(label_names, label_values)]
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    """
+    monotonically increasing counter, optionally split by labels
+    """
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        return self._values.get(key, 0)
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation),
+                 "# TYPE {} counter".format(self.name)]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append("{}{} {}".format(self.name, _format_labels(self.label_names, key), _format_value(value)))
+        return lines
+
+
+class Histogram:
+    """
+    cumulative bucket histogram in the prometheus exposition format
+    """
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][index] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def count(self, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        series = self._series.get(key)
+        return series["count"] if series else 0
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation),
+                 "# TYPE {} histogram".format(self.name)]
+        with self._lock:
+            items = sorted((key, dict(series, counts=list(series["counts"]))) for key, series in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, series["counts"]):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names + ("le",), key + (_format_value(float(bound)),))
+                lines.append("{}_bucket{} {}".format(self.name, labels, cumulative))
+            labels = _format_labels(self.label_names, key)
+            lines.append("{}_sum{} {}".format(self.name, labels, repr(series["sum"])))
+            lines.append("{}_count{} {}".format(self.name, labels, series["count"]))
+        return lines
+
+
+class Registry:
+    """
+    holds every metric exposed on /metrics
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")))
+DB_QUERY_LATENCY = REGISTRY.register(Histogram(
+    "db_query_duration_seconds", "time spent executing a single SQL statement"))
+DB_QUERIES_PER_REQUEST = REGISTRY.register(Histogram(
+    "db_queries_per_request", "number of SQL statements issued while serving a request", ("route",),
+    buckets=QUERY_COUNT_BUCKETS))
+DB_QUERIES_TOTAL = REGISTRY.register(Counter(
+    "db_queries_total", "total SQL statements executed"))
+SCHEDULE_COMPUTE_LATENCY = REGISTRY.register(Histogram(
+    "schedule_compute_duration_seconds", "time spent computing amortization schedules", ("kind",)))
+
+
+class RequestStats:
+    """
+    per request accumulator, mutated from whichever thread serves the handler
+    """
+
+    __slots__ = ("db_queries", "db_seconds", "timings")
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.timings = {}
+
+    def add_timing(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+
+_request_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+def start_request():
+    """
+    binds a fresh stats accumulator to the current request context
+    """
+    stats = RequestStats()
+    _request_stats.set(stats)
+    return stats
+
+
+def current_request_stats():
+    return _request_stats.get()
+
+
+@contextmanager
+def timed(name):
+    """
+    times a block, records it in the compute histogram and in the current request's Server-Timing entries
+    :param name: label used for the histogram and the Server-Timing metric name
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        SCHEDULE_COMPUTE_LATENCY.observe(elapsed, kind=name)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.add_timing(name, elapsed)
+
+
+def instrument_engine(engine):
+    """
+    attaches query counting and timing hooks to a sqlalchemy engine
+    :param engine:
+    :return:
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start_times = conn.info.get("query_start_time")
+        if not start_times:
+            return
+        elapsed = time.perf_counter() - start_times.pop()
+        DB_QUERY_LATENCY.observe(elapsed)
+        DB_QUERIES_TOTAL.inc()
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.db_queries += 1
+            stats.db_seconds += elapsed
+
+    return engine
+
+
+def server_timing_header(stats, total_seconds):
+    """
+    builds a Server-Timing header value from the request stats
+    :param stats: RequestStats
+    :param total_seconds: full request duration
+    :return: str
+    """
+    entries = ["app;dur={:.2f}".format(total_seconds * 1000)]
+    entries.append('db;dur={:.2f};desc="{} queries"'.format(stats.db_seconds * 1000, stats.db_queries))
+    for name, seconds in stats.timings.items():
+        entries.append("{};dur={:.2f}".format(name, seconds * 1000))
+    return ", ".join(entries)
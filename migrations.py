@@ -0,0 +1,86 @@
+from sqlalchemy import Column, Integer, MetaData, String, Table, inspect, select
+
+import models
+
+# applied schema versions are recorded here, one row per migration
+schema_metadata = MetaData()
+schema_version_table = Table(
+    'schema_version',
+    schema_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String)
+)
+
+
+def create_tables(connection):
+    models.Base.metadata.create_all(bind=connection)
+
+
+def add_user_loans_keys(connection):
+    """
+    rebuilds user_loans with its composite primary key, dropping duplicate and null rows on the way,
+    then adds the reverse index and the loans.owner_user_id index
+    """
+    if not inspect(connection).get_pk_constraint('user_loans').get('constrained_columns'):
+        connection.exec_driver_sql(
+            "CREATE TABLE user_loans_rebuilt ("
+            "user_id INTEGER NOT NULL REFERENCES users (id), "
+            "loan_id INTEGER NOT NULL REFERENCES loans (id), "
+            "PRIMARY KEY (user_id, loan_id))")
+        connection.exec_driver_sql(
+            "INSERT INTO user_loans_rebuilt (user_id, loan_id) "
+            "SELECT DISTINCT user_id, loan_id FROM user_loans WHERE user_id IS NOT NULL AND loan_id IS NOT NULL")
+        connection.exec_driver_sql("DROP TABLE user_loans")
+        connection.exec_driver_sql("ALTER TABLE user_loans_rebuilt RENAME TO user_loans")
+    create_indexes(connection, models.association_table, models.LoanModel.__table__)
+
+
+def create_indexes(connection, *tables):
+    """
+    creates any index declared on the tables that the database does not have yet
+    """
+    for table in tables:
+        for index in table.indexes:
+            index.create(bind=connection, checkfirst=True)
+
+
+def add_loan_listing_indexes(connection):
+    create_indexes(connection, models.LoanModel.__table__)
+
+
+def add_payment_ledger(connection):
+    for model in (models.PaymentModel, models.LoanStateModel):
+        model.__table__.create(bind=connection, checkfirst=True)
+
+
+# (version, description, function taking a connection), append new migrations at the end
+MIGRATIONS = [
+    (1, "create tables", create_tables),
+    (2, "user_loans primary key and lookup indexes", add_user_loans_keys),
+    (3, "loan listing filter indexes", add_loan_listing_indexes),
+    (4, "payments ledger and loan state snapshots", add_payment_ledger),
+]
+
+
+def applied_versions(connection):
+    return {row.version for row in connection.execute(select(schema_version_table.c.version))}
+
+
+def migrate(engine):
+    """
+    applies every migration not yet recorded in schema_version, each in its own transaction
+    :param engine:
+    :return: list of versions applied
+    """
+    schema_metadata.create_all(bind=engine)
+    with engine.connect() as connection:
+        done = applied_versions(connection)
+    applied = []
+    for version, description, migration in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as connection:
+            migration(connection)
+            connection.execute(schema_version_table.insert().values(version=version, description=description))
+        applied.append(version)
+    return applied
@@ -1,14 +1,17 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Table, Float
+from sqlalchemy import Column, ForeignKey, Integer, String, Table, Float, Index, BigInteger, DateTime, func
 from sqlalchemy.orm import relationship
 
 from database import Base
 
 
+# primary key (user_id, loan_id) serves a user's loans and rejects duplicate shares,
+# the reverse index serves a loan's users
 association_table = Table(
     'user_loans',
     Base.metadata,
-    Column('user_id', Integer, ForeignKey("users.id")),
-    Column('loan_id', Integer, ForeignKey("loans.id"))
+    Column('user_id', Integer, ForeignKey("users.id"), primary_key=True),
+    Column('loan_id', Integer, ForeignKey("loans.id"), primary_key=True),
+    Index('ix_user_loans_loan_id_user_id', 'loan_id', 'user_id')
 )
 
 class UserModel(Base):
@@ -27,7 +30,40 @@ class LoanModel(Base):
     id = Column(Integer, primary_key=True, index=True)
     amount = Column(Float)
     term_months = Column(Integer)
-    owner_user_id = Column(Integer)
+    owner_user_id = Column(Integer, index=True)
     interest = Column(Float)
 
     users = relationship('UserModel', secondary=association_table, back_populates='loans')
+
+    # GET /loans filters: term plus rate ("30 year loans over 5%") and amount ranges
+    __table_args__ = (
+        Index('ix_loans_term_months_interest', 'term_months', 'interest'),
+        Index('ix_loans_amount', 'amount'),
+    )
+
+
+class PaymentModel(Base):
+    """
+    payments ledger, one row per posted month with the balances right after it
+    """
+    __tablename__ = "payments"
+
+    loan_id = Column(Integer, ForeignKey("loans.id"), primary_key=True)
+    month = Column(Integer, primary_key=True)
+    amount_cents = Column(BigInteger)
+    interest_cents = Column(BigInteger)
+    balance_cents = Column(BigInteger)
+    cumulative_interest_cents = Column(BigInteger)
+    posted_at = Column(DateTime, server_default=func.now())
+
+
+class LoanStateModel(Base):
+    """
+    current servicing state of a loan, updated in place with every posted payment
+    """
+    __tablename__ = "loan_states"
+
+    loan_id = Column(Integer, ForeignKey("loans.id"), primary_key=True)
+    balance_cents = Column(BigInteger)
+    cumulative_interest_cents = Column(BigInteger)
+    last_posted_month = Column(Integer)
@@ -0,0 +1,113 @@
+import contextvars
+import functools
+import inspect
+import io
+import os
+import threading
+import uuid
+
+from fastapi import Request
+from fastapi.responses import PlainTextResponse
+
+import config
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_TOKEN_HEADER = "X-Profile-Token"
+PROFILE_ID_HEADER = "X-Profile-Id"
+PROFILE_SKIPPED_HEADER = "X-Profile-Skipped"
+
+# cProfile can't run two profilers at once (3.12+ refuses, older versions let one request's disable() switch
+# off another's), so one request is profiled at a time and the others run unprofiled
+_profile_lock = threading.Lock()
+# profiler of the current request, enabled by the profiled handler in the thread the handler runs in
+_request_profile = contextvars.ContextVar("request_profile", default=None)
+
+
+class _RequestProfile:
+    __slots__ = ("profile", "ran")
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.ran = False
+
+
+def profiled(func):
+    """
+    decorator for sync route handlers that enables the request's profiler around the handler, in the threadpool
+    thread the handler runs in, so only one profiler is active per request and the event loop is never profiled.
+    async handlers are refused: profiling them would enable the profiler on the event loop and attribute every
+    other request's work interleaving there to the profiled one.
+    when profiling is disabled in config the handler is returned untouched.
+    :param func: route handler
+    :return:
+    """
+    if inspect.iscoroutinefunction(func):
+        raise TypeError("profiled only supports sync route handlers, {} is async".format(func.__qualname__))
+    if not config.PROFILING_ENABLED:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        request_profile = _request_profile.get()
+        if request_profile is None:
+            return func(*args, **kwargs)
+        request_profile.ran = True
+        request_profile.profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            request_profile.profile.disable()
+    return wrapper
+
+
+def _render_stats(stats, limit=60):
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.sort_stats("cumulative").print_stats(limit)
+    return stream.getvalue()
+
+
+async def profile_request_middleware(request: Request, call_next):
+    """
+    runs the request's handler under cProfile when the X-Profile header is sent, for handlers decorated
+    with profiled.
+    X-Profile: text returns the pstats report instead of the response body, any other value stores the raw
+    profile under PROFILE_DIR and returns its id in the X-Profile-Id header.
+    while another request is being profiled the request runs unprofiled and the response says so in the
+    X-Profile-Skipped header. only installed when PROFILING_ENABLED is set.
+    """
+    mode = request.headers.get(PROFILE_HEADER)
+    if not mode:
+        return await call_next(request)
+    if config.PROFILING_TOKEN and request.headers.get(PROFILE_TOKEN_HEADER) != config.PROFILING_TOKEN:
+        return await call_next(request)
+    if not _profile_lock.acquire(blocking=False):
+        response = await call_next(request)
+        response.headers[PROFILE_SKIPPED_HEADER] = "another request is being profiled"
+        return response
+
+    import cProfile
+    import pstats
+
+    try:
+        request_profile = _RequestProfile(cProfile.Profile())
+        token = _request_profile.set(request_profile)
+        try:
+            response = await call_next(request)
+        finally:
+            _request_profile.reset(token)
+    finally:
+        _profile_lock.release()
+
+    if not request_profile.ran:
+        response.headers[PROFILE_SKIPPED_HEADER] = "route is not profiled"
+        return response
+    stats = pstats.Stats(request_profile.profile)
+    if mode.strip().lower() == "text":
+        return PlainTextResponse(_render_stats(stats), headers={"X-Profile-Status": str(response.status_code)})
+
+    profile_id = uuid.uuid4().hex
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    stats.dump_stats(os.path.join(config.PROFILE_DIR, profile_id + ".prof"))
+    response.headers[PROFILE_ID_HEADER] = profile_id
+    return response
@@ -0,0 +1,28 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+import warmup
+
+router = APIRouter(prefix="/health")
+
+
+@router.get("/live")
+def liveness():
+    """
+    the process is up and serving, says nothing about warm-up
+    :return:
+    """
+    return {
+        "status": "alive"
+    }
+
+
+@router.get("/ready")
+def get_readiness():
+    """
+    503 until the startup warm-up has finished so the load balancer holds traffic back
+    :return:
+    """
+    if not warmup.readiness.ready:
+        return JSONResponse(status_code=503, content=warmup.readiness.as_dict())
+    return warmup.readiness.as_dict()
@@ -0,0 +1,111 @@
+import os
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+
+import jobs
+
+router = APIRouter(prefix="/jobs")
+
+
+def _job_view(job):
+    return {
+        "job_id": job["id"],
+        "type": job["type"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"]
+    }
+
+
+def _get_job_or_404(job_id):
+    job = jobs.get_job_manager().store.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job
+
+
+@router.post("/", status_code=202)
+def submit_job(payload: dict):
+    """
+    submits a long running computation, poll GET /jobs/{job_id} for progress
+    sample payloads:
+        {"type": "schedule_export", "params": {"filters": {"term_months": 360}}}
+        {"type": "portfolio_summary", "params": {"month": 12, "loan_ids": [1, 2, 3]}}
+    :param payload:
+    :return: {
+    "message": "job submitted",
+    "data": {"job_id": "4f1c...", "status": "queued"},
+    "status": 202
+}
+    """
+    job_type = payload.get("type")
+    params = payload.get("params") or {}
+    if job_type not in jobs.JOB_TYPES:
+        raise HTTPException(status_code=400, detail="invalid job type, use one of " + ", ".join(jobs.JOB_TYPES))
+    if not isinstance(params, dict):
+        raise HTTPException(status_code=400, detail="invalid params")
+    if job_type == "portfolio_summary" and not isinstance(params.get("month"), int):
+        raise HTTPException(status_code=400, detail="portfolio_summary needs an integer month")
+    job_id = jobs.get_job_manager().submit(job_type, params)
+    if job_id is None:
+        raise HTTPException(status_code=429, detail="too many pending jobs, retry later", headers={"Retry-After": "30"})
+    return {
+        "message": "job submitted",
+        "data": {
+            "job_id": job_id,
+            "status": jobs.QUEUED
+        },
+        "status": 202
+    }
+
+
+@router.get("/{job_id}")
+def get_job(job_id: str):
+    """
+    status and progress (0 to 1) of a job
+    :param job_id:
+    :return:
+    """
+    return {
+        "message": "job found",
+        "data": _job_view(_get_job_or_404(job_id)),
+        "status": 200
+    }
+
+
+@router.get("/{job_id}/result")
+def get_job_result(job_id: str):
+    """
+    streams the result file of a finished job
+    :param job_id:
+    :return:
+    """
+    job = _get_job_or_404(job_id)
+    if job["status"] != jobs.SUCCEEDED:
+        raise HTTPException(status_code=409, detail="job is " + job["status"])
+    if not job["result_path"] or not os.path.exists(job["result_path"]):
+        raise HTTPException(status_code=410, detail="job result no longer available")
+    media_type = "application/x-ndjson" if job["result_path"].endswith(".jsonl") else "application/json"
+    return FileResponse(job["result_path"], media_type=media_type)
+
+
+@router.delete("/{job_id}")
+def cancel_job(job_id: str):
+    """
+    cancels a queued job, or asks a running one to stop at its next checkpoint
+    :param job_id:
+    :return:
+    """
+    job = _get_job_or_404(job_id)
+    if job["status"] in jobs.FINISHED_STATUSES:
+        raise HTTPException(status_code=409, detail="job is already " + job["status"])
+    jobs.get_job_manager().cancel(job_id)
+    return {
+        "message": "job cancellation requested",
+        "data": _job_view(_get_job_or_404(job_id)),
+        "status": 200
+    }
@@ -1,12 +1,60 @@
-from fastapi import APIRouter, Request, HTTPException
+import base64
+import json
+from typing import Union
+
+from fastapi import APIRouter, Request, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
 
 import models
 from DataService.data_service import DataService
-from utils import check_loan_details, check_user_details
+from compute_pool import compute_bound
+from profiling import profiled
+import config
+from amortization import MAX_SOLVER_INTEREST, SolverError, solve_payment, solve_term, solve_rate
+from utils import check_loan_details, check_user_details, schedule_etag, etag_matches
 
 router = APIRouter(prefix="/loans")
 
 
+LOAN_SORT_FIELDS = ("id", "amount", "interest", "term_months")
+MAX_PAGE_SIZE = 500
+MAX_SOLVE_BATCH = 1000
+
+
+def _encode_cursor(loan, sort_by, order):
+    return base64.urlsafe_b64encode(json.dumps([sort_by, order, getattr(loan, sort_by), loan.id]).encode()).decode()
+
+
+def _decode_cursor(cursor, sort_by, order):
+    """
+    :return: (last sort value, last id) of the previous page
+    raises a 400 when the cursor is malformed or was issued for another sort_by or order
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    if not isinstance(payload, list) or len(payload) != 4:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    cursor_sort_by, cursor_order, last_value, last_id = payload
+    if cursor_sort_by != sort_by or cursor_order != order:
+        raise HTTPException(status_code=400, detail="cursor does not match sort_by and order")
+    if not isinstance(last_id, int) or isinstance(last_id, bool):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    if last_value is None and sort_by == "id":
+        return None, last_id
+    if not isinstance(last_value, (int, float)) or isinstance(last_value, bool):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    return last_value, last_id
+
+
+def _cache_headers(etag):
+    return {
+        "ETag": etag,
+        "Cache-Control": "private, max-age={}".format(config.SCHEDULE_CACHE_MAX_AGE)
+    }
+
+
 @router.post("/")
 async def create_loan(request: Request):
     """
@@ -62,14 +110,70 @@ async def create_loan(request: Request):
         check_user_details(user_ids, owner_user_id)
 
         loan_data_service = DataService(models.LoanModel)
-        result = loan_data_service.create_loan(user_ids=user_ids, loan_amount=loan_amount, loan_interest=loan_interest,
-                                               loan_months=loan_months, owner_user_id=owner_user_id)
+        # off the event loop so concurrent writes can meet in the write batcher
+        result = await run_in_threadpool(loan_data_service.create_loan, user_ids=user_ids, loan_amount=loan_amount,
+                                         loan_interest=loan_interest, loan_months=loan_months,
+                                         owner_user_id=owner_user_id)
         return result
 
     except Exception as e:
         raise e
 
 
+@router.get("/")
+@profiled
+def list_loans(owner_user_id: Union[int, None] = None, term_months: Union[int, None] = None,
+               min_amount: Union[float, None] = None, max_amount: Union[float, None] = None,
+               min_interest: Union[float, None] = None, max_interest: Union[float, None] = None,
+               sort_by: str = "id", order: str = "asc", limit: int = 50, cursor: Union[str, None] = None):
+    """
+    lists loans filtered server side, e.g. /loans?term_months=360&min_interest=5&sort_by=amount&order=desc
+    pages are keyset based, pass next_cursor from the previous response as cursor to get the next one
+    :return: {
+    "message": "loans found",
+    "data": [
+        {
+            "amount": 250000.0,
+            "owner_user_id": 1,
+            "id": 1,
+            "term_months": 360,
+            "interest": 5.5
+        }
+    ],
+    "next_cursor": "WyJpZCIsICJhc2MiLCAxLCAxXQ==",
+    "status": 200
+}
+    """
+    if sort_by not in LOAN_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail="invalid sort_by, use one of " + ", ".join(LOAN_SORT_FIELDS))
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="invalid order, use asc or desc")
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail="invalid limit please send a value between 1 and {}".format(
+            MAX_PAGE_SIZE))
+    try:
+        filters = {
+            "owner_user_id": owner_user_id,
+            "term_months": term_months,
+            "min_amount": min_amount,
+            "max_amount": max_amount,
+            "min_interest": min_interest,
+            "max_interest": max_interest
+        }
+        after = _decode_cursor(cursor, sort_by, order) if cursor else None
+        data_service = DataService(models.LoanModel)
+        loans, has_more = data_service.list_loans(filters, sort_by=sort_by, descending=order == "desc", limit=limit,
+                                                  after=after)
+        return {
+            "message": "loans found" if loans else "no loans",
+            "data": loans,
+            "next_cursor": _encode_cursor(loans[-1], sort_by, order) if has_more else None,
+            "status": 200
+        }
+    except Exception as e:
+        raise e
+
+
 @router.get("/{loan_id}")
 async def get_loan(loan_id: int):
     """
@@ -135,16 +239,140 @@ async def share_loan(request: Request):
                 "status": 400
             }
         data_service = DataService(models.LoanModel)
-        result = data_service.share_loan(user_id=user_id, loan_id=loan_id)
+        result = await run_in_threadpool(data_service.share_loan, user_id=user_id, loan_id=loan_id)
         return result
 
     except Exception as e:
         raise e
 
+def _solve(problem, data_service):
+    """
+    solves one problem for the missing loan term, terms can come from an existing loan via loan_id
+    """
+    if not isinstance(problem, dict):
+        raise HTTPException(status_code=400, detail="invalid payload")
+    solve_for = problem.get("solve_for")
+    amount = problem.get("amount")
+    interest = problem.get("interest")
+    months = problem.get("months")
+    payment = problem.get("payment")
+    if problem.get("loan_id"):
+        amount, months, interest = data_service.get_loan_terms(problem.get("loan_id"))
+
+    required = {
+        "payment": ("amount", "interest", "months"),
+        "term": ("amount", "interest", "payment"),
+        "rate": ("amount", "months", "payment")
+    }
+    if solve_for not in required:
+        raise HTTPException(status_code=400, detail="invalid solve_for, use payment, term or rate")
+    values = {"amount": amount, "interest": interest, "months": months, "payment": payment}
+    for name in required[solve_for]:
+        if not isinstance(values[name], (int, float)) or isinstance(values[name], bool):
+            raise HTTPException(status_code=400, detail="missing or invalid " + name)
+    if months is not None and (not isinstance(months, int) or months > 360):
+        raise HTTPException(status_code=400, detail="invalid months please enter an integer value <=360(30 years)")
+    if "interest" in required[solve_for] and not 0 <= interest <= MAX_SOLVER_INTEREST:
+        raise HTTPException(status_code=400,
+                            detail="invalid interest please enter a value between 0 and {}".format(MAX_SOLVER_INTEREST))
+
+    try:
+        if solve_for == "payment":
+            payment_cents, evaluations = solve_payment(amount, months, interest)
+            result = {"payment": payment_cents / 100.00, "schedule_evaluations": evaluations}
+        elif solve_for == "term":
+            months, final_payment_cents, evaluations = solve_term(amount, interest, payment)
+            result = {"months": months, "final_payment": final_payment_cents / 100.00,
+                      "schedule_evaluations": evaluations}
+        else:
+            interest, iterations = solve_rate(amount, months, payment)
+            result = {"interest": round(interest, 4), "iterations": iterations}
+    except SolverError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ArithmeticError:
+        # e.g. an amount so large the cent conversion overflows
+        raise HTTPException(status_code=400, detail="loan terms out of range")
+    return dict({"solve_for": solve_for, "amount": amount, "interest": interest, "months": months,
+                 "payment": payment}, **result)
+
+
+@router.post("/solve")
+@compute_bound
+@profiled
+def solve_loan(problem: dict):
+    """
+    solves for the payment, term or rate given the other loan terms
+    sample payloads:
+        {"solve_for": "payment", "amount": 250000, "interest": 4.5, "months": 180}
+        {"solve_for": "term", "amount": 250000, "interest": 4.5, "payment": 2000}
+        {"solve_for": "rate", "amount": 250000, "months": 360, "payment": 1500}
+        {"solve_for": "payment", "loan_id": 1}
+    :param problem:
+    :return: {
+    "message": "solved",
+    "data": {
+        "solve_for": "payment",
+        "amount": 250000,
+        "interest": 4.5,
+        "months": 180,
+        "payment": 1912.48,
+        "schedule_evaluations": 2
+    },
+    "status": 200
+}
+    """
+    try:
+        data_service = DataService(models.LoanModel)
+        return {
+            "message": "solved",
+            "data": _solve(problem, data_service),
+            "status": 200
+        }
+    except Exception as e:
+        raise e
+
+
+@router.post("/solve/batch")
+@compute_bound
+@profiled
+def solve_loans(payload: dict):
+    """
+    solves many problems at once, a failing problem reports its error without failing the batch
+    sample payload:
+        {"problems": [{"solve_for": "payment", "loan_id": 1}, {"solve_for": "rate", "amount": 250000,
+                      "months": 360, "payment": 1500}]}
+    :param payload:
+    :return: {"message": "solved", "data": [{...}, {"error": "..."}], "status": 200}
+    """
+    problems = payload.get("problems")
+    if not isinstance(problems, list) or not problems:
+        raise HTTPException(status_code=400, detail="invalid payload")
+    if len(problems) > MAX_SOLVE_BATCH:
+        raise HTTPException(status_code=400, detail="too many problems, send at most {}".format(MAX_SOLVE_BATCH))
+    data_service = DataService(models.LoanModel)
+    results = []
+    for problem in problems:
+        try:
+            results.append(_solve(problem, data_service))
+        except HTTPException as e:
+            results.append({"error": e.detail})
+        except Exception as e:
+            # one problem that breaks the solver must not fail the others
+            results.append({"error": str(e) or e.__class__.__name__})
+    return {
+        "message": "solved",
+        "data": results,
+        "status": 200
+    }
+
+
 @router.get("/schedule/{loan_id}")
-def get_loan_schedule(loan_id: int):
+@compute_bound
+@profiled
+def get_loan_schedule(loan_id: int, request: Request, response: Response):
     """
     builds the loan amortization schedule month by month
+    responds with 304 and skips the computation when If-None-Match matches the loan's current ETag
 
     :param loan_id:
     :return:
@@ -178,16 +406,26 @@ def get_loan_schedule(loan_id: int):
     try:
 
         data_service = DataService(models.LoanModel)
-        result = data_service.get_loan_schedule(loan_id)
+        loan_terms = data_service.get_loan_terms(loan_id)
+        headers = _cache_headers(schedule_etag(*loan_terms))
+        if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+        result = data_service.schedule_for_terms(loan_terms)
         return result
 
     except Exception as e:
         raise e
 
 @router.get("/summary/{loan_id}/month/{month_val}")
-def get_loan_summary(loan_id: int, month_val: int):
+@compute_bound
+@profiled
+def get_loan_summary(loan_id: int, month_val: int, request: Request, response: Response):
     """
     creates a loan summary up to the specified month
+    once payments are posted, posted months come from the payments ledger and later months are projected from the
+    loan's current state
+    responds with 304 and skips the computation when If-None-Match matches the loan's current ETag
     :param loan_id:
     :param month_val:
     :return: {
@@ -210,8 +448,63 @@ def get_loan_summary(loan_id: int, month_val: int):
         raise HTTPException(status_code=400, detail="invalid month please send a month value <= 360")
     try:
         data_service = DataService(models.LoanModel)
-        result = data_service.get_loan_summary(loan_id, month_val)
+        loan_terms, loan_state = data_service.get_loan_servicing(loan_id)
+        # posting a payment moves last_posted_month and with it the tag
+        last_posted_month = loan_state[2] if loan_state else 0
+        headers = _cache_headers(schedule_etag(*loan_terms, month_val, last_posted_month))
+        if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+        result = data_service.summary_for_servicing(loan_id, loan_terms, loan_state, month_val)
+        return result
+
+    except Exception as e:
+        raise e
+
+
+@router.post("/{loan_id}/payments")
+def post_payment(loan_id: int, payload: dict):
+    """
+    posts the next monthly payment for a loan
+    sample payload:
+    {
+        "amount": 1266.71
+    }
+    :param loan_id:
+    :param payload:
+    :return: {
+    "message": "payment posted",
+    "data": {
+        "loan_id": 1,
+        "month": 1,
+        "payment": 1266.71,
+        "interest": 937.5,
+        "Remaining_balance": 249670.79
+    },
+    "status": 200
+}
+    """
+    amount = payload.get("amount")
+    if not isinstance(amount, (int, float)) or isinstance(amount, bool) or amount <= 0:
+        raise HTTPException(status_code=400, detail="invalid payment amount")
+    try:
+        data_service = DataService(models.LoanModel)
+        result = data_service.post_payment(loan_id, amount)
         return result
+    except Exception as e:
+        raise e
 
+
+@router.get("/{loan_id}/state")
+def get_loan_state(loan_id: int):
+    """
+    as of today servicing state of a loan: balance, interest charged so far and last posted month
+    :param loan_id:
+    :return:
+    """
+    try:
+        data_service = DataService(models.LoanModel)
+        result = data_service.get_loan_state(loan_id)
+        return result
     except Exception as e:
         raise e
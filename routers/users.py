@@ -1,8 +1,10 @@
 from fastapi import APIRouter, Request, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from typing import Union
 
 import models
 from DataService.data_service import DataService
+from profiling import profiled
 from utils import check_email
 
 router = APIRouter(prefix="/users")
@@ -16,7 +18,6 @@ async def get_all_users(email: Union[str, None] = None):
     try:
         data_service = DataService(models.UserModel)
         if email and check_email(email):
-            print(email)
             result = data_service.get_user_by_email(email)
         else:
             result = data_service.get_all_users()
@@ -60,7 +61,9 @@ async def create_user(request: Request):
             raise Exception("invalid email address")
 
         data_service = DataService(models.UserModel)
-        result = data_service.write_user(email=email, first_name=first_name, last_name=last_name)
+        # off the event loop so concurrent writes can meet in the write batcher
+        result = await run_in_threadpool(data_service.write_user, email=email, first_name=first_name,
+                                         last_name=last_name)
 
         return result
     except Exception as e:
@@ -97,6 +100,7 @@ async def get_user_by_email(user_email: str):
         raise e
 
 @router.get("/{user_id}/loans")
+@profiled
 def get_user_loans(user_id: int):
     """
     gets all loan objects for a user
@@ -1 +1 @@
-uvicorn main:app --reload
\ No newline at end of file
+python manage.py migrate && uvicorn main:app --reload
\ No newline at end of file
@@ -0,0 +1,444 @@
+import socket
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import config
+import metrics
+from amortization import SCHEDULE_ALGORITHM_VERSION
+from singleflight import SingleFlight
+
+CACHE_REQUESTS = metrics.REGISTRY.register(metrics.Counter(
+    "schedule_cache_requests_total", "schedule cache lookups by result", ("kind", "result")))
+CACHE_ERRORS = metrics.REGISTRY.register(metrics.Counter(
+    "schedule_cache_errors_total", "schedule cache backend failures, treated as misses"))
+
+_PACK_FORMAT_VERSION = 1
+_SCHEDULE_HEADER = struct.Struct("<BI")
+_SUMMARY = struct.Struct("<B3d")
+
+
+def cache_key(kind, amount, term_months, interest, *extra):
+    """
+    cache key for output that is a pure function of the loan terms
+    :param kind: schedule or summary
+    :param amount:
+    :param term_months:
+    :param interest:
+    :param extra: anything else the output depends on, e.g. the summary month
+    :return: str
+    """
+    # the pack format is part of the key so workers on either side of a format change don't read each other's
+    # values from a shared backend
+    parts = (kind, SCHEDULE_ALGORITHM_VERSION, _PACK_FORMAT_VERSION, amount, term_months, interest) + extra
+    return ":".join(repr(part) if isinstance(part, float) else str(part) for part in parts)
+
+
+def _to_little_endian(values):
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def pack_schedule(result_list):
+    """
+    packs a schedule as two little endian int64 arrays of cents (remaining balance, payment), month is implicit
+    :param result_list: output of build_schedule
+    :return: bytes
+    """
+    balances = array("q", (round(row["Remaining_balance"] * 100) for row in result_list))
+    payments = array("q", (round(row["Monthly_payment"] * 100) for row in result_list))
+    return (_SCHEDULE_HEADER.pack(_PACK_FORMAT_VERSION, len(result_list))
+            + _to_little_endian(balances).tobytes() + _to_little_endian(payments).tobytes())
+
+
+def unpack_schedule(blob):
+    """
+    inverse of pack_schedule
+    :param blob: bytes
+    :return: list of monthly objects
+    """
+    version, months = _SCHEDULE_HEADER.unpack_from(blob)
+    if version != _PACK_FORMAT_VERSION:
+        raise ValueError("unknown schedule pack format")
+    offset = _SCHEDULE_HEADER.size
+    balances = array("q")
+    balances.frombytes(blob[offset:offset + months * 8])
+    payments = array("q")
+    payments.frombytes(blob[offset + months * 8:offset + months * 16])
+    _to_little_endian(balances)
+    _to_little_endian(payments)
+    return [
+        {
+            "Month": month,
+            "Remaining_balance": balance / 100.00,
+            "Monthly_payment": payment / 100.00
+        }
+        for month, balance, payment in zip(range(1, months + 1), balances, payments)
+    ]
+
+
+def pack_summary(summary):
+    """
+    packs a summary as three doubles
+    :param summary: output of build_summary
+    :return: bytes
+    """
+    return _SUMMARY.pack(_PACK_FORMAT_VERSION, summary["Current_Principal"],
+                         summary["Aggregate Amount of interest paid"],
+                         summary["Aggregate Amount of principal paid"])
+
+
+def unpack_summary(blob):
+    """
+    inverse of pack_summary
+    :param blob: bytes
+    :return: summary object
+    """
+    version, principal, interest_paid, principal_paid = _SUMMARY.unpack(blob)
+    if version != _PACK_FORMAT_VERSION:
+        raise ValueError("unknown summary pack format")
+    return {
+        "Current_Principal": principal,
+        "Aggregate Amount of interest paid": interest_paid,
+        "Aggregate Amount of principal paid": principal_paid
+    }
+
+
+class MemoryBackend:
+    """
+    per process LRU with TTL
+    """
+
+    def __init__(self, max_entries=10000, ttl=None):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self._ttl if self._ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend:
+    """
+    cache in a local sqlite file so every worker process on the host shares it.
+    entries expire after ttl seconds and the least recently read ones are evicted past max_entries.
+    reads only write accessed_at back once it is touch_interval seconds old, and the size is checked every
+    tenth of max_entries sets or evict_interval seconds, so hits and sets don't queue on sqlite's write lock
+    for bookkeeping.
+    """
+
+    def __init__(self, path, max_entries=10000, ttl=None, touch_interval=60, evict_interval=5):
+        import sqlite3
+
+        self._sqlite3 = sqlite3
+        self._path = path
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._touch_interval = touch_interval
+        self._evict_interval = evict_interval
+        self._evict_every = max(1, max_entries // 10)
+        self._sets_since_evict = 0
+        self._next_evict_at = 0.0
+        self._evict_lock = threading.Lock()
+        self._local = threading.local()
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS schedule_cache ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)")
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_schedule_cache_accessed_at ON schedule_cache (accessed_at)")
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        now = time.time()
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT value, expires_at, accessed_at FROM schedule_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at, accessed_at = row
+        if expires_at is not None and expires_at < now:
+            connection.execute("DELETE FROM schedule_cache WHERE key = ?", (key,))
+            return None
+        if now - accessed_at >= self._touch_interval:
+            # eviction order only needs to be coarse, most hits stay read only
+            connection.execute("UPDATE schedule_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return bytes(value)
+
+    def set(self, key, value):
+        now = time.time()
+        expires_at = now + self._ttl if self._ttl else None
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO schedule_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, value, expires_at, now))
+        with self._evict_lock:
+            self._sets_since_evict += 1
+            due = self._sets_since_evict >= self._evict_every or now >= self._next_evict_at
+            if due:
+                self._sets_since_evict = 0
+                self._next_evict_at = now + self._evict_interval
+        if due:
+            self._evict(connection)
+
+    def _evict(self, connection):
+        with connection:
+            count = connection.execute("SELECT COUNT(*) FROM schedule_cache").fetchone()[0]
+            if count > self._max_entries:
+                # evict a tenth at a time so inserts past the limit don't each pay for a delete
+                overflow = count - self._max_entries + self._evict_every
+                connection.execute(
+                    "DELETE FROM schedule_cache WHERE key IN "
+                    "(SELECT key FROM schedule_cache ORDER BY accessed_at LIMIT ?)", (overflow,))
+
+    def delete(self, key):
+        self._connection().execute("DELETE FROM schedule_cache WHERE key = ?", (key,))
+
+    def clear(self):
+        self._connection().execute("DELETE FROM schedule_cache")
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisBackend:
+    """
+    minimal RESP client so the cache can live in redis (or anything speaking its protocol) without a client
+    library. eviction is left to the server's maxmemory-policy, ttl is sent with every SET.
+    """
+
+    def __init__(self, url, ttl=None, timeout=1.0):
+        parsed = urlparse(url)
+        self._host = parsed.hostname or "127.0.0.1"
+        self._port = parsed.port or 6379
+        self._db = int(parsed.path.lstrip("/") or 0)
+        self._password = parsed.password
+        self._ttl = ttl
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self._host, self._port), timeout=self._timeout)
+        self._local.sock = sock
+        self._local.reader = sock.makefile("rb")
+        if self._password:
+            self._command("AUTH", self._password)
+        if self._db:
+            self._command("SELECT", self._db)
+
+    def _read_reply(self):
+        reader = self._local.reader
+        line = reader.readline()
+        if not line:
+            raise RedisError("connection closed")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload.decode()
+        if prefix == b"-":
+            raise RedisError(payload.decode())
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if prefix == b"*":
+            return [self._read_reply() for _ in range(int(payload))]
+        raise RedisError("unexpected reply")
+
+    def _command(self, *args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        self._local.sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def execute(self, *args):
+        if getattr(self._local, "sock", None) is None:
+            self._connect()
+        try:
+            return self._command(*args)
+        except (OSError, RedisError):
+            self.close()
+            raise
+
+    def close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+        self._local.sock = None
+
+    def get(self, key):
+        return self.execute("GET", key)
+
+    def set(self, key, value):
+        if self._ttl:
+            self.execute("SET", key, value, "PX", int(self._ttl * 1000))
+        else:
+            self.execute("SET", key, value)
+
+    def delete(self, key):
+        self.execute("DEL", key)
+
+    def clear(self):
+        self.execute("FLUSHDB")
+
+
+class ScheduleCache:
+    """
+    get-or-compute front for a cache backend, values are stored packed. backend failures count as misses so
+    a broken cache never fails a request. concurrent misses on one key share a single computation.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        self._flight = SingleFlight("schedule_cache")
+
+    def get_or_compute(self, kind, key, compute, pack, unpack):
+        """
+        :param kind: label for the hit/miss counters
+        :param key: cache key
+        :param compute: called on a miss
+        :param pack: value -> bytes
+        :param unpack: bytes -> value
+        :return: the cached or computed value
+        """
+        try:
+            blob = self.backend.get(key)
+        except Exception:
+            CACHE_ERRORS.inc()
+            blob = None
+        if blob is not None:
+            try:
+                value = unpack(blob)
+            except Exception:
+                # truncated or foreign value, recomputing overwrites it
+                CACHE_ERRORS.inc()
+            else:
+                with self._stats_lock:
+                    self.hits += 1
+                CACHE_REQUESTS.inc(kind=kind, result="hit")
+                return value
+
+        return self._flight.do(key, lambda: self._compute_and_put(kind, key, compute, pack))
+
+    def _compute_and_put(self, kind, key, compute, pack):
+        with self._stats_lock:
+            self.misses += 1
+        CACHE_REQUESTS.inc(kind=kind, result="miss")
+        value = compute()
+        self.put(key, pack(value))
+        return value
+
+    def put(self, key, blob):
+        try:
+            self.backend.set(key, blob)
+        except Exception:
+            CACHE_ERRORS.inc()
+
+    def hit_ratio(self):
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return hits / total if total else 0.0
+
+
+class NullBackend:
+    """
+    cache disabled
+    """
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+def create_backend(name=None):
+    """
+    builds the backend named in config.CACHE_BACKEND
+    :param name: overrides the configured backend
+    :return:
+    """
+    name = name or config.CACHE_BACKEND
+    ttl = config.CACHE_TTL_SECONDS or None
+    if name == "none":
+        return NullBackend()
+    if name == "memory":
+        return MemoryBackend(max_entries=config.CACHE_MAX_ENTRIES, ttl=ttl)
+    if name == "sqlite":
+        return SQLiteBackend(config.CACHE_SQLITE_PATH, max_entries=config.CACHE_MAX_ENTRIES, ttl=ttl)
+    if name == "redis":
+        return RedisBackend(config.CACHE_REDIS_URL, ttl=ttl)
+    raise ValueError("unknown cache backend " + name)
+
+
+_schedule_cache = None
+_schedule_cache_lock = threading.Lock()
+
+
+def get_schedule_cache():
+    """
+    process wide schedule cache, created on first use
+    """
+    global _schedule_cache
+    if _schedule_cache is None:
+        with _schedule_cache_lock:
+            if _schedule_cache is None:
+                _schedule_cache = ScheduleCache(create_backend())
+    return _schedule_cache
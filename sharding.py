@@ -0,0 +1,222 @@
+import threading
+import zlib
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import operators, visitors
+
+# column each table is routed by, association rows, payments and loan states live with their loan
+SHARD_KEYS = {
+    "users": "id",
+    "loans": "id",
+    "user_loans": "loan_id",
+    "payments": "loan_id",
+    "loan_states": "loan_id",
+}
+
+# global id sequences and unique keys, kept on the first shard
+allocator_metadata = MetaData()
+id_allocator_table = Table(
+    'id_allocator',
+    allocator_metadata,
+    Column('name', String, primary_key=True),
+    Column('next_id', Integer, nullable=False)
+)
+# users.email is only unique per shard, this table makes it unique across shards
+user_emails_table = Table(
+    'user_emails',
+    allocator_metadata,
+    Column('email', String, primary_key=True),
+    Column('user_id', Integer, nullable=False)
+)
+
+
+class ShardRouter:
+    """
+    maps ids to shards by hash, shard ids are the string positions "0".."n-1" of the configured engines
+    """
+
+    def __init__(self, engines):
+        self.engines = {str(index): engine for index, engine in enumerate(engines)}
+        self.shard_ids = list(self.engines)
+
+    def shard_for_id(self, value):
+        return self.shard_ids[zlib.crc32(str(int(value)).encode()) % len(self.shard_ids)]
+
+    def shards_for_ids(self, values):
+        return sorted({self.shard_for_id(value) for value in values})
+
+
+class IdAllocator:
+    """
+    hands out globally unique ids per table from id_allocator, reserving a block at a time so inserts
+    don't round trip to the first shard every time
+    """
+
+    def __init__(self, engine, block_size=100):
+        self._engine = engine
+        self._block_size = block_size
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def next_id(self, name):
+        with self._lock:
+            next_value, end = self._blocks.get(name, (0, 0))
+            if next_value >= end:
+                next_value, end = self._reserve(name)
+            self._blocks[name] = (next_value + 1, end)
+            return next_value
+
+    def _reserve(self, name):
+        table = id_allocator_table
+        while True:
+            with self._engine.begin() as connection:
+                updated = connection.execute(
+                    update(table).where(table.c.name == name).values(next_id=table.c.next_id + self._block_size))
+                if updated.rowcount:
+                    end = connection.execute(select(table.c.next_id).where(table.c.name == name)).scalar_one()
+                    return end - self._block_size, end
+            try:
+                with self._engine.begin() as connection:
+                    connection.execute(table.insert().values(name=name, next_id=1 + self._block_size))
+                return 1, 1 + self._block_size
+            except IntegrityError:
+                # another worker created the sequence first, reserve from it
+                continue
+
+
+def backfill_user_emails(engines):
+    """
+    adds the users created before user_emails existed, on every shard, to user_emails on the first shard
+    :param engines: every shard, the first one holding user_emails
+    :return: number of emails added
+    """
+    table = user_emails_table
+    with engines[0].connect() as connection:
+        known = set(connection.execute(select(table.c.email)).scalars())
+    added = 0
+    for engine in engines:
+        with engine.connect() as connection:
+            rows = connection.exec_driver_sql("SELECT email, id FROM users").fetchall()
+        missing = [{"email": email, "user_id": user_id} for email, user_id in rows if email not in known]
+        if missing:
+            with engines[0].begin() as connection:
+                connection.execute(table.insert(), missing)
+            known.update(row["email"] for row in missing)
+            added += len(missing)
+    return added
+
+
+def _shard_key_comparisons(statement):
+    """
+    finds `shard key == value` and `shard key IN (...)` criteria in a statement's where clause
+    :return: list of (operator, value), or None when the criteria contain an OR and can't narrow the shards
+    """
+    whereclause = getattr(statement, "whereclause", None)
+    if whereclause is None:
+        return []
+    binds = {}
+    columns = set()
+    binaries = []
+    has_or = []
+
+    def visit_bindparam(bind):
+        binds[bind] = bind.effective_value
+
+    def visit_column(column):
+        table = getattr(column, "table", None)
+        if table is not None and SHARD_KEYS.get(getattr(table, "name", None)) == column.name:
+            columns.add(column)
+
+    def visit_clauselist(clauselist):
+        if clauselist.operator is operators.or_:
+            has_or.append(clauselist)
+
+    # traverse is breadth first, so binaries are matched once their columns and binds are known
+    visitors.traverse(whereclause, {}, {"bindparam": visit_bindparam, "column": visit_column,
+                                        "binary": binaries.append, "clauselist": visit_clauselist,
+                                        "expression_clauselist": visit_clauselist})
+    if has_or:
+        return None
+    comparisons = []
+    for binary in binaries:
+        if binary.left in columns and binary.right in binds:
+            comparisons.append((binary.operator, binds[binary.right]))
+        elif binary.right in columns and binary.left in binds:
+            comparisons.append((binary.operator, binds[binary.left]))
+    return comparisons
+
+
+def make_sharded_session_kwargs(router, allocator):
+    """
+    sessionmaker arguments for a ShardedSession routing by hashed id
+    :param router: ShardRouter
+    :param allocator: IdAllocator
+    :return: dict
+    """
+    from sqlalchemy.ext.horizontal_shard import ShardedSession
+
+    def shard_chooser(mapper, instance, clause=None):
+        if instance is None:
+            return router.shard_ids[0]
+        table_name = mapper.local_table.name
+        key = SHARD_KEYS.get(table_name, "id")
+        value = getattr(instance, key)
+        if value is None and key == "id":
+            value = allocator.next_id(table_name)
+            instance.id = value
+        return router.shard_for_id(value)
+
+    def identity_chooser(mapper, primary_key, *, lazy_loaded_from, execution_options, bind_arguments, **kw):
+        if lazy_loaded_from is not None:
+            return [lazy_loaded_from.identity_token]
+        key = SHARD_KEYS.get(mapper.local_table.name, "id")
+        for column, value in zip(mapper.primary_key, primary_key):
+            if column.name == key:
+                return [router.shard_for_id(value)]
+        return router.shard_ids
+
+    def execute_chooser(orm_context):
+        comparisons = _shard_key_comparisons(orm_context.statement)
+        if not comparisons:
+            return router.shard_ids
+        shards = set()
+        for operator, value in comparisons:
+            if operator == operators.eq:
+                shards.add(router.shard_for_id(value))
+            elif operator == operators.in_op:
+                shards.update(router.shards_for_ids(value))
+            else:
+                return router.shard_ids
+        return sorted(shards)
+
+    return {
+        "class_": ShardedSession,
+        "shards": router.engines,
+        "shard_chooser": shard_chooser,
+        "identity_chooser": identity_chooser,
+        "execute_chooser": execute_chooser,
+    }
+
+
+def first_shard_bind_arguments(router):
+    """
+    bind_arguments for the tables in allocator_metadata, empty when not sharded
+    :param router: ShardRouter or None
+    :return: dict
+    """
+    if router is None:
+        return {}
+    return {"shard_id": router.shard_ids[0]}
+
+
+def shard_bind_arguments(router, value):
+    """
+    bind_arguments pinning a core statement to the shard owning value, empty when not sharded
+    :param router: ShardRouter or None
+    :param value: shard key value
+    :return: dict
+    """
+    if router is None:
+        return {}
+    return {"shard_id": router.shard_for_id(value)}
@@ -0,0 +1,58 @@
+import threading
+
+import metrics
+
+COALESCED_CALLS = metrics.REGISTRY.register(metrics.Counter(
+    "singleflight_coalesced_total", "calls that waited on an identical in flight call instead of running", ("kind",)))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    collapses concurrent calls with the same key into one: the first caller runs the function, callers
+    arriving while it runs wait and share its result or exception. nothing is kept once the call returns.
+    """
+
+    def __init__(self, kind):
+        self._kind = kind
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        """
+        :param key: hashable identity of the call
+        :param function: called without arguments by the first caller only
+        :return: the function's result
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            COALESCED_CALLS.inc(kind=self._kind)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
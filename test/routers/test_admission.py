@@ -0,0 +1,95 @@
+from fastapi.testclient import TestClient
+from main import app
+import asyncio
+import contextvars
+import threading
+import unittest
+from unittest import mock
+from utils_helper import create_user_helper
+
+import admission
+from admission import AdmissionController, RouteLimiter, parse_limits
+from compute_pool import run_in_compute_pool
+
+client = TestClient(app)
+request_label = contextvars.ContextVar("request_label", default=None)
+
+
+class AdmissionTests(unittest.TestCase):
+    def setUp(self):
+        self.saved = admission.controller
+
+    def tearDown(self):
+        admission.controller = self.saved
+
+    def test_parse_limits(self):
+        assert parse_limits("GET /users/=2:8, GET /loans/schedule/{loan_id}=4") == {
+            "GET /users/": (2, 8), "GET /loans/schedule/{loan_id}": (4, 0)}
+
+    def test_limiter_queues_then_rejects(self):
+        async def scenario():
+            limiter = RouteLimiter("GET", "/x", 1, 1)
+            assert await limiter.acquire(1) is None
+            waiting = asyncio.ensure_future(limiter.acquire(1))
+            await asyncio.sleep(0)
+            assert await limiter.acquire(1) == "queue_full"
+            limiter.release()
+            assert await waiting is None
+            assert await limiter.acquire(0.05) == "timeout"
+            limiter.release()
+            assert limiter.active == 0
+
+        asyncio.run(scenario())
+
+    def test_slot_handed_over_as_timeout_fires_is_not_leaked(self):
+        async def scenario():
+            limiter = RouteLimiter("GET", "/x", 1, 1)
+            assert await limiter.acquire(1) is None
+
+            async def wait_for_tie(waiter, timeout):
+                # the holder releases in the same iteration the timeout fires
+                limiter.release()
+                raise asyncio.TimeoutError()
+
+            with mock.patch.object(asyncio, "wait_for", wait_for_tie):
+                assert await limiter.acquire(1) is None
+            assert limiter.active == 1
+            limiter.release()
+            assert limiter.active == 0
+            assert await limiter.acquire(1) is None
+
+        asyncio.run(scenario())
+
+    def test_busy_route_rejected_with_retry_after(self):
+        user_id = create_user_helper()[0].json().get("data").get("id")
+        admission.controller = AdmissionController({"GET /users/{user_id}/loans": (1, 0)})
+        admission.controller.limiters[0].active = 1
+
+        response = client.get("/users/{}/loans".format(user_id))
+        assert response.status_code == 429
+        assert response.headers.get("retry-after") == "1"
+        # other routes are not held up
+        assert client.get("/users/{}".format(user_id)).status_code == 200
+
+        admission.controller.limiters[0].active = 0
+        assert client.get("/users/{}/loans".format(user_id)).status_code != 429
+
+    def test_literal_paths_matched_before_parameterised(self):
+        controller = AdmissionController({"GET /loans/{loan_id}": (1, 0), "GET /loans/": (1, 0)})
+        assert [limiter.path for limiter in controller.limiters] == ["/loans/", "/loans/{loan_id}"]
+
+    def test_compute_pool_keeps_context(self):
+        def handler():
+            return request_label.get(), threading.current_thread().name
+
+        async def call():
+            request_label.set("request-1")
+            return await run_in_compute_pool(handler)
+
+        label, thread_name = asyncio.run(call())
+        assert label == "request-1"
+        assert thread_name.startswith("compute")
+
+
+if __name__ == '__main__':
+    unittest.main()
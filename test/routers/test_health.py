@@ -0,0 +1,40 @@
+from fastapi.testclient import TestClient
+from main import app
+import unittest
+from utils_helper import create_user_helper, create_loan_helper
+
+import warmup
+from schedule_cache import get_schedule_cache, cache_key
+
+client = TestClient(app)
+class HealthRoutesTests(unittest.TestCase):
+    def test_liveness(self):
+        response = client.get("/health/live")
+        assert response.status_code == 200
+
+    def test_readiness_waits_for_warmup(self):
+        warmup.readiness = warmup.Readiness()
+        response = client.get("/health/ready")
+        assert response.status_code == 503
+
+        with TestClient(app) as started_client:
+            assert warmup.readiness.wait(timeout=10)
+            response = started_client.get("/health/ready")
+        assert response.status_code == 200
+        assert response.json().get("status") == "ready"
+
+    def test_warmup_for_loan_ids(self):
+        user_response, user_email = create_user_helper()
+        user_id = user_response.json().get("data").get("id")
+        loan_id = create_loan_helper([user_id], user_id).json().get("data").get("id")
+        state = warmup.Readiness()
+        get_schedule_cache().backend.clear()
+
+        warmup.warm_schedule_cache(state, loan_ids=[loan_id])
+        assert state.ready
+        assert state.warmed == 1
+        assert get_schedule_cache().backend.get(cache_key("schedule", 250000.0, 360, 4.5)) is not None
+
+
+if __name__ == '__main__':
+    unittest.main()
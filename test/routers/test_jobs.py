@@ -0,0 +1,102 @@
+from fastapi.testclient import TestClient
+from main import app
+import json
+import time
+import unittest
+from unittest import mock
+from utils_helper import create_user_helper, create_loan_helper
+
+import compute_pool
+import config
+import jobs
+from schedule_cache import get_schedule_cache
+
+client = TestClient(app)
+
+
+def wait_for_job(job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get("/jobs/" + job_id).json().get("data")
+        if job.get("status") in jobs.FINISHED_STATUSES:
+            return job
+        time.sleep(0.05)
+    raise AssertionError("job did not finish")
+
+
+class JobRoutesTests(unittest.TestCase):
+    def setUp(self):
+        user_response, user_email = create_user_helper()
+        user_id = user_response.json().get("data").get("id")
+        self.loan_ids = [create_loan_helper([user_id], user_id).json().get("data").get("id") for _ in range(2)]
+
+    def test_schedule_export(self):
+        response = client.post("/jobs", json={"type": "schedule_export", "params": {"loan_ids": self.loan_ids}})
+        assert response.status_code == 202
+        job_id = response.json().get("data").get("job_id")
+
+        job = wait_for_job(job_id)
+        assert job.get("status") == "succeeded"
+        assert job.get("progress") == 1.0
+
+        response = client.get("/jobs/" + job_id + "/result")
+        assert response.status_code == 200
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert [line.get("loan_id") for line in lines] == sorted(self.loan_ids)
+        assert len(lines[0].get("schedule")) == 360
+
+    def test_portfolio_summary(self):
+        response = client.post("/jobs", json={"type": "portfolio_summary",
+                                              "params": {"month": 12, "loan_ids": self.loan_ids}})
+        job_id = response.json().get("data").get("job_id")
+        assert wait_for_job(job_id).get("status") == "succeeded"
+
+        totals = client.get("/jobs/" + job_id + "/result").json()
+        single = client.get("/loans/summary/" + str(self.loan_ids[0]) + "/month/12").json().get("data")
+        assert totals.get("loans") == 2
+        assert totals.get("Original_amount") == 500000.0
+        assert abs(totals.get("Current_Principal") - 2 * single.get("Current_Principal")) < 0.02
+
+    def test_jobs_bypass_schedule_cache_and_compute_pool(self):
+        cache = get_schedule_cache()
+        lookups = cache.hits + cache.misses
+        with mock.patch.object(compute_pool, "_executor", side_effect=AssertionError("job used the compute pool")), \
+                mock.patch.object(config, "COMPUTE_POOL_PROCESSES", 2):
+            for job in ({"type": "schedule_export", "params": {"loan_ids": self.loan_ids}},
+                        {"type": "portfolio_summary", "params": {"month": 12, "loan_ids": self.loan_ids}}):
+                job_id = client.post("/jobs", json=job).json().get("data").get("job_id")
+                assert wait_for_job(job_id).get("status") == "succeeded"
+        assert cache.hits + cache.misses == lookups
+
+    def test_invalid_job_type(self):
+        response = client.post("/jobs", json={"type": "mine_bitcoin", "params": {}})
+        assert response.status_code == 400
+
+    def test_unknown_job(self):
+        assert client.get("/jobs/missing").status_code == 404
+
+    def test_cancel_queued_job(self):
+        manager = jobs.JobManager(jobs.config.JOBS_DB_PATH, jobs.config.JOB_RESULT_DIR, workers=1)
+        manager._executor.submit(time.sleep, 0.5)
+        job_id = manager.submit("schedule_export", {"loan_ids": self.loan_ids})
+        manager.cancel(job_id)
+        manager.shutdown(wait=True)
+        job = client.get("/jobs/" + job_id).json().get("data")
+        assert job.get("status") == "cancelled"
+        assert client.get("/jobs/" + job_id + "/result").status_code == 409
+
+    def test_too_many_pending_jobs(self):
+        manager = jobs.JobManager(jobs.config.JOBS_DB_PATH, jobs.config.JOB_RESULT_DIR, workers=1, max_pending=0)
+        assert manager.submit("schedule_export", {}) is None
+        manager.shutdown()
+
+    def test_orphaned_jobs_fail_on_start(self):
+        store = jobs.JobStore(jobs.config.JOBS_DB_PATH)
+        job_id = store.create("schedule_export", {})
+        store.update(job_id, status=jobs.RUNNING, worker_pid=2 ** 22 + 1)
+        store.fail_orphaned()
+        assert store.get(job_id).get("status") == "failed"
+
+
+if __name__ == '__main__':
+    unittest.main()
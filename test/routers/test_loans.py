@@ -1,7 +1,10 @@
+import base64
+import json
 from fastapi.testclient import TestClient
 from main import app
 import unittest
 from utils_helper import create_user_helper, create_loan_helper
+from amortization import build_summary
 
 client = TestClient(app)
 class LoansRoutesTests(unittest.TestCase):
@@ -155,6 +158,23 @@ class LoansRoutesTests(unittest.TestCase):
         })
         assert response.json().get("message") == "loan shared"
 
+    def test_share_loan_twice_no_duplicate(self):
+        user_response1, user_email1 = create_user_helper()
+        user_id1 = user_response1.json().get("data").get("id")
+        loan_create_response = create_loan_helper([user_id1], user_id1)
+        loan_id = loan_create_response.json().get("data").get("id")
+        user_response2, user_email2 = create_user_helper()
+        user_id2 = user_response2.json().get("data").get("id")
+
+        for _ in range(2):
+            response = client.post("/loans/share", json={
+                "user_id": user_id2,
+                "loan_id": loan_id
+            })
+            assert response.json().get("message") == "loan shared"
+        users = client.get("/loans/{}".format(loan_id)).json().get("data").get("loan_details").get("users")
+        assert sorted(user.get("id") for user in users) == sorted([user_id1, user_id2])
+
     def test_get_loan_schedule(self):
         user_response, user_email = create_user_helper()
         user_id = user_response.json().get("data").get("id")
@@ -178,6 +198,197 @@ class LoansRoutesTests(unittest.TestCase):
         assert response.status_code == 200
         assert response.json().get("message") == 'summary as of end of month 10'
 
+    def test_get_loan_schedule_etag_not_modified(self):
+        user_response, user_email = create_user_helper()
+        user_id = user_response.json().get("data").get("id")
+        loan_create_response = create_loan_helper([user_id], user_id)
+        loan_id = loan_create_response.json().get("data").get("id")
+        response = client.get("/loans/schedule/{}".format(loan_id))
+        etag = response.headers.get("etag")
+        assert etag
+        assert "max-age" in response.headers.get("cache-control")
+
+        response = client.get("/loans/schedule/{}".format(loan_id), headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers.get("etag") == etag
+
+    def test_get_loan_summary_etag_depends_on_month(self):
+        user_response, user_email = create_user_helper()
+        user_id = user_response.json().get("data").get("id")
+        loan_create_response = create_loan_helper([user_id], user_id)
+        loan_id = loan_create_response.json().get("data").get("id")
+        etag = client.get("/loans/summary/{}/month/{}".format(loan_id, 10)).headers.get("etag")
+
+        response = client.get("/loans/summary/{}/month/{}".format(loan_id, 10), headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        response = client.get("/loans/summary/{}/month/{}".format(loan_id, 11), headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.json().get("message") == 'summary as of end of month 11'
+
+    def test_list_loans_filters_and_pages(self):
+        user_response, user_email = create_user_helper()
+        user_id = user_response.json().get("data").get("id")
+        amounts = [100000, 200000, 300000, 400000, 500000]
+        for amount in amounts:
+            client.post("/loans", json={
+                "loan_detail": {
+                    "amount": amount,
+                    "interest": 5.25,
+                    "months": 180
+                },
+                "user_detail": {
+                    "user_ids": [user_id],
+                    "owner_user_id": user_id
+                }
+            })
+        create_loan_helper([user_id], user_id)
+
+        seen = []
+        cursor = None
+        while True:
+            params = {"owner_user_id": user_id, "term_months": 180, "min_interest": 5, "sort_by": "amount",
+                      "order": "desc", "limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            response = client.get("/loans", params=params)
+            assert response.status_code == 200
+            seen.extend(loan.get("amount") for loan in response.json().get("data"))
+            cursor = response.json().get("next_cursor")
+            if not cursor:
+                break
+        assert seen == sorted(amounts, reverse=True)
+
+    def test_list_loans_invalid_cursor(self):
+        def encode(payload):
+            return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+        for cursor in ("not base64!", encode({"a": 1}), encode(["amount", "asc", [1], 5]),
+                       encode(["amount", "asc", {"a": 1}, 5]), encode(["amount", "asc", None, 5]),
+                       encode(["amount", "asc", 1000, "5"]), encode([[1], 5])):
+            response = client.get("/loans", params={"sort_by": "amount", "cursor": cursor})
+            assert response.status_code == 400
+
+        response = client.get("/loans", params={"sort_by": "id", "cursor": encode(["id", "asc", None, 1])})
+        assert response.status_code == 200
+
+    def test_list_loans_cursor_tied_to_sort(self):
+        user_response, user_email = create_user_helper()
+        user_id = user_response.json().get("data").get("id")
+        for _ in range(3):
+            create_loan_helper([user_id], user_id)
+        cursor = client.get("/loans", params={"sort_by": "amount", "limit": 1}).json().get("next_cursor")
+        response = client.get("/loans", params={"sort_by": "amount", "order": "desc", "cursor": cursor})
+        assert response.status_code == 400
+        response = client.get("/loans", params={"sort_by": "interest", "cursor": cursor})
+        assert response.status_code == 400
+        response = client.get("/loans", params={"sort_by": "amount", "limit": 1, "cursor": cursor})
+        assert response.status_code == 200
+
+    def test_list_loans_invalid_sort(self):
+        response = client.get("/loans", params={"sort_by": "email"})
+        assert response.status_code == 400
+
+    def test_solve_payment_rate_term(self):
+        response = client.post("/loans/solve", json={"solve_for": "payment", "amount": 250000, "interest": 4.5,
+                                                     "months": 360})
+        payment = response.json().get("data").get("payment")
+        assert response.status_code == 200
+        assert abs(payment - 1266.71) < 0.02
+
+        response = client.post("/loans/solve", json={"solve_for": "rate", "amount": 250000, "months": 360,
+                                                     "payment": payment})
+        assert abs(response.json().get("data").get("interest") - 4.5) < 0.01
+
+        response = client.post("/loans/solve", json={"solve_for": "term", "amount": 250000, "interest": 4.5,
+                                                     "payment": payment})
+        assert response.json().get("data").get("months") == 360
+
+    def test_solve_term_never_pays_off(self):
+        response = client.post("/loans/solve", json={"solve_for": "term", "amount": 250000, "interest": 4.5,
+                                                     "payment": 500})
+        assert response.status_code == 400
+
+    def test_solve_term_payment_within_a_cent_of_interest(self):
+        response = client.post("/loans/solve", json={"solve_for": "term", "amount": 250002.64, "interest": 4.5,
+                                                     "payment": 937.5051})
+        assert response.status_code == 400
+
+    def test_solve_invalid_interest(self):
+        for interest in (-2400, 101):
+            response = client.post("/loans/solve", json={"solve_for": "payment", "amount": 250000,
+                                                         "interest": interest, "months": 360})
+            assert response.status_code == 400
+        response = client.post("/loans/solve", json={"solve_for": "term", "amount": 250000, "interest": -2400,
+                                                     "payment": 2000})
+        assert response.status_code == 400
+
+    def test_solve_batch_isolates_failing_problems(self):
+        response = client.post("/loans/solve/batch", json={"problems": [
+            {"solve_for": "term", "amount": 250002.64, "interest": 4.5, "payment": 937.5051},
+            {"solve_for": "payment", "amount": 250000, "interest": -2400, "months": 360},
+            {"solve_for": "term", "amount": 1e308, "interest": 0, "payment": 1e300},
+            {"solve_for": "payment", "amount": 250000, "interest": 4.5, "months": 360}
+        ]})
+        assert response.status_code == 200
+        results = response.json().get("data")
+        assert all("error" in result for result in results[:3])
+        assert abs(results[3].get("payment") - 1266.71) < 0.02
+
+    def test_solve_batch_with_loan_id(self):
+        user_response, user_email = create_user_helper()
+        user_id = user_response.json().get("data").get("id")
+        loan_id = create_loan_helper([user_id], user_id).json().get("data").get("id")
+        response = client.post("/loans/solve/batch", json={"problems": [
+            {"solve_for": "payment", "loan_id": loan_id},
+            {"solve_for": "rate", "amount": 1000, "months": 12, "payment": 1}
+        ]})
+        results = response.json().get("data")
+        assert results[0].get("months") == 360
+        assert "error" in results[1]
+
+    def test_post_payments_and_summary_from_ledger(self):
+        user_response, user_email = create_user_helper()
+        user_id = user_response.json().get("data").get("id")
+        loan_id = create_loan_helper([user_id], user_id).json().get("data").get("id")
+        scheduled = client.get("/loans/schedule/{}".format(loan_id)).json().get("data")
+        etag = client.get("/loans/summary/{}/month/{}".format(loan_id, 2)).headers.get("etag")
+
+        for _ in range(2):
+            response = client.post("/loans/{}/payments".format(loan_id), json={"amount": 1266.71})
+            assert response.json().get("message") == "payment posted"
+        assert response.json().get("data").get("month") == 2
+        assert response.json().get("data").get("Remaining_balance") == scheduled[1].get("Remaining_balance")
+
+        state = client.get("/loans/{}/state".format(loan_id)).json().get("data")
+        assert state.get("Last_posted_month") == 2
+        assert state.get("Current_Principal") == scheduled[1].get("Remaining_balance")
+
+        response = client.get("/loans/summary/{}/month/{}".format(loan_id, 2), headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.json().get("data").get("Current_Principal") == scheduled[1].get("Remaining_balance")
+
+        projected = client.get("/loans/summary/{}/month/{}".format(loan_id, 12)).json().get("data")
+        assert abs(projected.get("Current_Principal") - scheduled[11].get("Remaining_balance")) < 1
+
+    def test_projection_after_on_schedule_payments_matches_schedule(self):
+        user_response, user_email = create_user_helper()
+        user_id = user_response.json().get("data").get("id")
+        loan_id = create_loan_helper([user_id], user_id).json().get("data").get("id")
+        scheduled = client.get("/loans/schedule/{}".format(loan_id)).json().get("data")
+
+        for posted in range(1, 4):
+            client.post("/loans/{}/payments".format(loan_id),
+                        json={"amount": scheduled[posted - 1].get("Monthly_payment")})
+            for month_val in (posted + 1, 12, 180, 359, 360):
+                summary = client.get("/loans/summary/{}/month/{}".format(loan_id, month_val)).json().get("data")
+                assert summary.pop("Last_posted_month") == posted
+                assert summary == build_summary(250000, 360, 4.5, month_val)
+
+    def test_post_payment_invalid_amount(self):
+        response = client.post("/loans/1/payments", json={"amount": -5})
+        assert response.status_code == 400
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,33 @@
+from fastapi.testclient import TestClient
+from main import app
+import unittest
+import config
+from utils_helper import create_user_helper, create_loan_helper
+
+client = TestClient(app)
+class MetricsRoutesTests(unittest.TestCase):
+    def test_metrics_exposes_route_latency(self):
+        user_response, user_email = create_user_helper()
+        user_id = user_response.json().get("data").get("id")
+        loan_create_response = create_loan_helper([user_id], user_id)
+        loan_id = loan_create_response.json().get("data").get("id")
+        client.get("/loans/schedule/{}".format(loan_id))
+
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert 'http_request_duration_seconds_count{method="GET",route="/loans/schedule/{loan_id}",status="200"}' in response.text
+        assert "db_queries_total" in response.text
+        assert 'schedule_compute_duration_seconds_count{kind="schedule"}' in response.text
+
+    def test_server_timing_header(self):
+        config.SERVER_TIMING_ENABLED = True
+        try:
+            response = client.get("/users/500")
+        finally:
+            config.SERVER_TIMING_ENABLED = False
+        assert response.headers.get("Server-Timing").startswith("app;dur=")
+        assert 'db;dur=' in response.headers.get("Server-Timing")
+
+
+if __name__ == '__main__':
+    unittest.main()
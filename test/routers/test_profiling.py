@@ -0,0 +1,94 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import os
+import tempfile
+import unittest
+
+import config
+import profiling
+
+
+def build_app():
+    test_app = FastAPI()
+    test_app.middleware("http")(profiling.profile_request_middleware)
+
+    @test_app.get("/work")
+    @profiling.profiled
+    def work():
+        return {"total": sum(range(10000))}
+
+    @test_app.get("/plain")
+    def plain():
+        return {"total": 1}
+
+    return test_app
+
+
+class ProfilingTests(unittest.TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.saved = (config.PROFILING_ENABLED, config.PROFILE_DIR, config.PROFILING_TOKEN)
+        config.PROFILING_ENABLED = True
+        config.PROFILE_DIR = self.profile_dir
+        config.PROFILING_TOKEN = None
+        self.client = TestClient(build_app())
+
+    def tearDown(self):
+        config.PROFILING_ENABLED, config.PROFILE_DIR, config.PROFILING_TOKEN = self.saved
+
+    def test_profile_disabled_returns_handler_untouched(self):
+        config.PROFILING_ENABLED = False
+        def handler():
+            return 1
+        assert profiling.profiled(handler) is handler
+
+    def test_no_header_no_profile(self):
+        response = self.client.get("/work")
+        assert response.json().get("total") == sum(range(10000))
+        assert "X-Profile-Id" not in response.headers
+        assert os.listdir(self.profile_dir) == []
+
+    def test_profile_stored(self):
+        response = self.client.get("/work", headers={"X-Profile": "1"})
+        assert response.json().get("total") == sum(range(10000))
+        profile_id = response.headers.get("X-Profile-Id")
+        assert os.path.exists(os.path.join(self.profile_dir, profile_id + ".prof"))
+
+    def test_profile_text_covers_handler(self):
+        response = self.client.get("/work", headers={"X-Profile": "text"})
+        assert response.headers.get("X-Profile-Status") == "200"
+        assert "work" in response.text
+
+    def test_async_handler_refused(self):
+        async def handler():
+            return 1
+        for enabled in (True, False):
+            config.PROFILING_ENABLED = enabled
+            with self.assertRaises(TypeError):
+                profiling.profiled(handler)
+
+    def test_route_without_decorator_is_not_profiled(self):
+        response = self.client.get("/plain", headers={"X-Profile": "1"})
+        assert response.json().get("total") == 1
+        assert response.headers.get("X-Profile-Skipped") == "route is not profiled"
+        assert os.listdir(self.profile_dir) == []
+
+    def test_one_profiled_request_at_a_time(self):
+        # another request holds the profiler
+        with profiling._profile_lock:
+            response = self.client.get("/work", headers={"X-Profile": "text"})
+        assert response.json().get("total") == sum(range(10000))
+        assert response.headers.get("X-Profile-Skipped") == "another request is being profiled"
+        assert os.listdir(self.profile_dir) == []
+
+        response = self.client.get("/work", headers={"X-Profile": "1"})
+        assert "X-Profile-Id" in response.headers
+
+    def test_profile_token_required(self):
+        config.PROFILING_TOKEN = "secret"
+        response = self.client.get("/work", headers={"X-Profile": "text"})
+        assert response.json().get("total") == sum(range(10000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,11 @@
 from fastapi.testclient import TestClient
 from main import app
+from database import engine
+from migrations import migrate
 import random
 import string
 
+migrate(engine)
 client = TestClient(app)
 def create_user_helper():
     letters = string.ascii_lowercase
@@ -0,0 +1,144 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+
+import config
+import models
+from DataService import data_service
+from DataService.data_service import DataService
+from database import RoutingSession, parse_primary_until, start_read_consistency
+from migrations import migrate
+from sqlalchemy.orm import sessionmaker
+
+
+class ReplicaRoutingTests(unittest.TestCase):
+    """
+    primary and replica are two unrelated sqlite files, so where a read lands shows in its result
+    """
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.primary = create_engine("sqlite:///" + os.path.join(directory, "primary.db"))
+        self.replica = create_engine("sqlite:///" + os.path.join(directory, "replica.db"))
+        migrate(self.primary)
+        migrate(self.replica)
+        self.session_factory = sessionmaker(class_=RoutingSession, primary=self.primary, replicas=[self.replica])
+        start_read_consistency()
+
+    def write_user(self, email):
+        session = self.session_factory()
+        try:
+            session.add(models.UserModel(email=email, first_name="foo", last_name="bar"))
+            session.commit()
+        finally:
+            session.close()
+
+    def find_user(self, email):
+        session = self.session_factory()
+        try:
+            return session.query(models.UserModel).filter(models.UserModel.email == email).first()
+        finally:
+            session.close()
+
+    def test_writes_go_to_primary_reads_to_replica(self):
+        session = self.session_factory()
+        session.add(models.UserModel(email="a@gmail.com", first_name="foo", last_name="bar"))
+        session.commit()
+        session.close()
+        start_read_consistency()
+
+        assert self.find_user("a@gmail.com") is None
+        with self.primary.connect() as connection:
+            assert connection.exec_driver_sql("select count(*) from users").scalar() == 1
+
+    def test_read_your_writes_after_commit(self):
+        self.write_user("b@gmail.com")
+        assert self.find_user("b@gmail.com") is not None
+
+    def test_read_in_writing_session_uses_primary(self):
+        session = self.session_factory()
+        try:
+            session.add(models.UserModel(email="c@gmail.com", first_name="foo", last_name="bar"))
+            session.flush()
+            assert session.query(models.UserModel).filter(models.UserModel.email == "c@gmail.com").first()
+            session.rollback()
+        finally:
+            session.close()
+
+    def test_session_pinned_to_primary_reads_primary(self):
+        self.write_user("d@gmail.com")
+        start_read_consistency()
+        session = self.session_factory(info={"primary": True})
+        try:
+            assert session.query(models.UserModel).filter(models.UserModel.email == "d@gmail.com").first()
+        finally:
+            session.close()
+
+    def test_post_payment_reads_state_from_primary(self):
+        for engine in (self.primary, self.replica):
+            with engine.begin() as connection:
+                connection.exec_driver_sql(
+                    "insert into loans (id, amount, interest, term_months) values (1, 1000, 12.0, 12)")
+        saved = data_service.SessionLocal
+        data_service.SessionLocal = self.session_factory
+        try:
+            loan_service = DataService(models.LoanModel)
+            assert loan_service.post_payment(1, 100)["data"]["month"] == 1
+            # a new request, the replica still has no loan state
+            start_read_consistency()
+            assert loan_service.post_payment(1, 100)["data"]["month"] == 2
+        finally:
+            data_service.SessionLocal = saved
+
+    def test_pinned_loan_terms_lookup_does_not_join_replica_lookup(self):
+        with self.primary.begin() as connection:
+            connection.exec_driver_sql(
+                "insert into loans (id, amount, interest, term_months) values (7, 1000, 4.5, 12)")
+        replica_lookup_started = threading.Event()
+        release_replica_lookup = threading.Event()
+
+        class SlowReplicaLookup(DataService):
+            def _query_loan_terms(self, loan_id):
+                replica_lookup_started.set()
+                release_replica_lookup.wait(5)
+                return super()._query_loan_terms(loan_id)
+
+        saved = data_service.SessionLocal
+        data_service.SessionLocal = self.session_factory
+        try:
+            # a request that has not written, its lookup goes to the replica where the loan doesn't exist yet
+            leader = threading.Thread(target=lambda: self.assertRaises(
+                HTTPException, SlowReplicaLookup(models.LoanModel).get_loan_terms, 7))
+            leader.start()
+            assert replica_lookup_started.wait(5)
+            # the request that just created the loan
+            start_read_consistency(primary_until=time.time() + 60)
+            assert DataService(models.LoanModel).get_loan_terms(7) == (1000.0, 12, 4.5)
+        finally:
+            release_replica_lookup.set()
+            leader.join()
+            data_service.SessionLocal = saved
+
+    def test_primary_until_cookie_is_bounded(self):
+        assert parse_primary_until(None) == 0.0
+        assert parse_primary_until("soon") == 0.0
+        assert parse_primary_until("inf") == 0.0
+        assert parse_primary_until("nan") == 0.0
+        assert parse_primary_until(repr(time.time() + 10 ** 9)) <= time.time() + config.READ_YOUR_WRITES_SECONDS
+        primary_until = time.time() + config.READ_YOUR_WRITES_SECONDS / 2
+        assert parse_primary_until(repr(primary_until)) == primary_until
+
+    def test_without_replicas_everything_uses_primary(self):
+        session_factory = sessionmaker(class_=RoutingSession, primary=self.primary)
+        session = session_factory()
+        assert session.get_bind() is self.primary
+        session.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+
+import models
+from loan_store import LoanLinks, LoanStore, load_loan_links, load_loan_store
+from migrations import migrate
+
+
+class LoanStoreTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.engines = [create_engine("sqlite:///" + os.path.join(directory, "loans{}.db".format(index)))
+                        for index in range(2)]
+        for engine in self.engines:
+            migrate(engine)
+        # odd ids on the first database, even ids on the second, as two shards would hold them
+        for loan_id in range(1, 11):
+            with self.engines[loan_id % 2].begin() as connection:
+                connection.execute(models.LoanModel.__table__.insert().values(
+                    id=loan_id, amount=1000.0 * loan_id, interest=4.5, term_months=12 * loan_id,
+                    owner_user_id=loan_id % 3 or None))
+                connection.execute(models.association_table.insert(), [
+                    {"user_id": user_id, "loan_id": loan_id} for user_id in range(1, 4) if loan_id % user_id == 0])
+
+    def test_store_lookups(self):
+        store = LoanStore()
+        store.append(3, 250000.0, 4.5, 360, 7)
+        store.append(9, 1234.56, 6.0, 12, None)
+        assert len(store) == 2
+        assert store.get(9).amount == 1234.56
+        assert store.get(9).owner_user_id is None
+        assert store.get(3).terms == (250000.0, 360, 4.5)
+        assert store.get(4) is None
+        with self.assertRaises(ValueError):
+            store.append(5, 1.0, 1.0, 1, None)
+
+    def test_store_is_compact(self):
+        store = LoanStore()
+        for loan_id in range(1, 10001):
+            store.append(loan_id, 250000.0, 4.5, 360, loan_id)
+        # about 360MB for 10M loans
+        assert store.nbytes() / len(store) <= 36
+
+    def test_load_merges_engines_in_id_order(self):
+        store = load_loan_store(self.engines)
+        assert list(store.ids) == list(range(1, 11))
+        assert store.terms(store.position(4)) == (4000.0, 48, 4.5)
+        assert store.get(3).owner_user_id is None
+
+    def test_load_with_criteria_and_pages(self):
+        loan = models.LoanModel
+        store = load_loan_store(self.engines, [loan.amount >= 3000], after_id=4, limit=3)
+        assert list(store.ids) == [5, 6, 7]
+
+    def test_links_both_directions(self):
+        links = load_loan_links(self.engines)
+        assert list(links.loans_for_user(2)) == [2, 4, 6, 8, 10]
+        assert list(links.loans_for_user(3)) == [3, 6, 9]
+        assert list(links.users_for_loan(6)) == [1, 2, 3]
+        assert list(links.users_for_loan(42)) == []
+
+    def test_links_from_pairs(self):
+        links = LoanLinks([(1, 5), (1, 7), (2, 5)], [(5, 1), (5, 2), (7, 1)])
+        assert list(links.users_for_loan(5)) == [1, 2]
+        assert links.nbytes() == 8 * (2 + 3 + 3 + 2 + 3 + 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
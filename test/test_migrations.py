@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine, inspect
+
+from migrations import migrate, MIGRATIONS
+
+
+class MigrationsTests(unittest.TestCase):
+    def setUp(self):
+        path = os.path.join(tempfile.mkdtemp(), "migrations.db")
+        self.engine = create_engine("sqlite:///" + path)
+
+    def test_migrate_fresh_database(self):
+        applied = migrate(self.engine)
+        assert applied == [version for version, description, migration in MIGRATIONS]
+        tables = inspect(self.engine).get_table_names()
+        for table in ("users", "loans", "user_loans", "schema_version"):
+            assert table in tables
+
+    def test_migrate_is_idempotent(self):
+        migrate(self.engine)
+        assert migrate(self.engine) == []
+
+    def test_user_loans_keys_rebuild_old_table(self):
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql("CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR, "
+                                       "first_name VARCHAR, last_name VARCHAR)")
+            connection.exec_driver_sql("CREATE TABLE loans (id INTEGER PRIMARY KEY, amount FLOAT, "
+                                       "term_months INTEGER, owner_user_id INTEGER, interest FLOAT)")
+            connection.exec_driver_sql("CREATE TABLE user_loans (user_id INTEGER, loan_id INTEGER)")
+            connection.exec_driver_sql("INSERT INTO user_loans VALUES (1, 1), (1, 1), (2, 1), (NULL, 3)")
+
+        migrate(self.engine)
+
+        inspector = inspect(self.engine)
+        assert inspector.get_pk_constraint("user_loans")["constrained_columns"] == ["user_id", "loan_id"]
+        assert "ix_user_loans_loan_id_user_id" in [index["name"] for index in inspector.get_indexes("user_loans")]
+        assert "ix_loans_owner_user_id" in [index["name"] for index in inspector.get_indexes("loans")]
+        with self.engine.connect() as connection:
+            rows = connection.exec_driver_sql("SELECT user_id, loan_id FROM user_loans ORDER BY user_id").fetchall()
+        assert [tuple(row) for row in rows] == [(1, 1), (2, 1)]
+
+
+if __name__ == '__main__':
+    unittest.main()
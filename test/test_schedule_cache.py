@@ -0,0 +1,207 @@
+import os
+import socketserver
+import tempfile
+import threading
+import time
+import unittest
+
+import schedule_cache
+from schedule_cache import (MemoryBackend, SQLiteBackend, RedisBackend, ScheduleCache, cache_key, pack_schedule,
+                            unpack_schedule, pack_summary, unpack_summary)
+from amortization import build_schedule, build_summary
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """
+    speaks just enough RESP for RedisBackend: GET, SET [PX], DEL, FLUSHDB
+    """
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        store = self.server.store
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            command = args[0].upper()
+            if command == b"GET":
+                entry = store.get(args[1])
+                if entry is None or (entry[1] is not None and entry[1] < time.time()):
+                    self.wfile.write(b"$-1\r\n")
+                else:
+                    self.wfile.write(b"$%d\r\n%s\r\n" % (len(entry[0]), entry[0]))
+            elif command == b"SET":
+                expires_at = None
+                if len(args) == 5 and args[3].upper() == b"PX":
+                    expires_at = time.time() + int(args[4]) / 1000
+                store[args[1]] = (args[2], expires_at)
+                self.wfile.write(b"+OK\r\n")
+            elif command == b"DEL":
+                self.wfile.write(b":%d\r\n" % (1 if store.pop(args[1], None) else 0))
+            elif command == b"FLUSHDB":
+                store.clear()
+                self.wfile.write(b"+OK\r\n")
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeRedisHandler)
+        self.store = {}
+
+
+class ScheduleCacheTests(unittest.TestCase):
+    def test_pack_schedule_round_trip(self):
+        for terms in [(250000, 360, 4.5), (1000, 12, 7.25), (99999, 240, 3.1)]:
+            rows = build_schedule(*terms)
+            assert unpack_schedule(pack_schedule(rows)) == rows
+
+    def test_pack_summary_round_trip(self):
+        summary = build_summary(250000, 360, 4.5, 10)
+        assert unpack_summary(pack_summary(summary)) == summary
+
+    def test_cache_key_includes_extra(self):
+        assert cache_key("summary", 250000, 360, 4.5, 10) != cache_key("summary", 250000, 360, 4.5, 11)
+
+    def test_memory_backend_lru_and_ttl(self):
+        backend = MemoryBackend(max_entries=2)
+        backend.set("a", b"1")
+        backend.set("b", b"2")
+        backend.get("a")
+        backend.set("c", b"3")
+        assert backend.get("b") is None
+        assert backend.get("a") == b"1"
+
+        backend = MemoryBackend(ttl=0.01)
+        backend.set("a", b"1")
+        time.sleep(0.02)
+        assert backend.get("a") is None
+
+    def test_sqlite_backend_shared_between_instances(self):
+        path = os.path.join(tempfile.mkdtemp(), "cache.db")
+        writer = SQLiteBackend(path, max_entries=10)
+        reader = SQLiteBackend(path, max_entries=10)
+        writer.set("a", b"\x00\x01")
+        assert reader.get("a") == b"\x00\x01"
+        for index in range(20):
+            writer.set(str(index), b"x")
+        assert reader.get("a") is None
+        assert reader.get("19") == b"x"
+
+    def test_sqlite_backend_hits_touch_accessed_at_coarsely(self):
+        path = os.path.join(tempfile.mkdtemp(), "cache.db")
+        backend = SQLiteBackend(path, touch_interval=60)
+        backend.set("a", b"1")
+        accessed_at = backend._connection().execute("SELECT accessed_at FROM schedule_cache").fetchone()[0]
+        assert backend.get("a") == b"1"
+        assert backend._connection().execute("SELECT accessed_at FROM schedule_cache").fetchone()[0] == accessed_at
+
+        backend = SQLiteBackend(path, touch_interval=0)
+        time.sleep(0.01)
+        assert backend.get("a") == b"1"
+        assert backend._connection().execute("SELECT accessed_at FROM schedule_cache").fetchone()[0] > accessed_at
+
+    def test_sqlite_backend_concurrent_writers(self):
+        path = os.path.join(tempfile.mkdtemp(), "cache.db")
+        backends = [SQLiteBackend(path, max_entries=50) for _ in range(2)]
+        errors = []
+
+        def write(worker):
+            backend = backends[worker % len(backends)]
+            try:
+                for index in range(200):
+                    key = "{}:{}".format(worker, index)
+                    backend.set(key, b"x" * 64)
+                    assert backend.get(key) in (b"x" * 64, None)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write, args=(worker,)) for worker in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        count = backends[0]._connection().execute("SELECT COUNT(*) FROM schedule_cache").fetchone()[0]
+        # each instance checks the size every tenth of max_entries sets
+        assert count <= 50 + 2 * 6 * 5
+
+    def test_redis_backend_against_fake_server(self):
+        server = FakeRedisServer()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            backend = RedisBackend("redis://127.0.0.1:{}/0".format(server.server_address[1]), ttl=60)
+            backend.set("a", b"\r\n\x00")
+            assert backend.get("a") == b"\r\n\x00"
+            backend.delete("a")
+            assert backend.get("a") is None
+            backend.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_get_or_compute_tracks_hit_ratio(self):
+        cache = ScheduleCache(MemoryBackend())
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return build_schedule(1000, 12, 7.25)
+
+        first = cache.get_or_compute("schedule", "k", compute, pack_schedule, unpack_schedule)
+        second = cache.get_or_compute("schedule", "k", compute, pack_schedule, unpack_schedule)
+        assert first == second
+        assert len(calls) == 1
+        assert cache.hit_ratio() == 0.5
+
+    def test_unreadable_value_is_a_miss(self):
+        backend = MemoryBackend()
+        cache = ScheduleCache(backend)
+        key = cache_key("schedule", 1000, 12, 7.25)
+        backend.set(key, b"\x01\x0c")
+        schedule = cache.get_or_compute("schedule", key, lambda: build_schedule(1000, 12, 7.25), pack_schedule,
+                                        unpack_schedule)
+        assert schedule == build_schedule(1000, 12, 7.25)
+        assert cache.misses == 1
+        assert unpack_schedule(backend.get(key)) == schedule
+
+    def test_cache_key_includes_pack_format(self):
+        key = cache_key("schedule", 1000, 12, 7.25)
+        saved = schedule_cache._PACK_FORMAT_VERSION
+        schedule_cache._PACK_FORMAT_VERSION = saved + 1
+        try:
+            assert cache_key("schedule", 1000, 12, 7.25) != key
+        finally:
+            schedule_cache._PACK_FORMAT_VERSION = saved
+
+    def test_hit_and_miss_counts_are_exact_under_threads(self):
+        cache = ScheduleCache(MemoryBackend())
+        cache.get_or_compute("schedule", "k", lambda: build_schedule(1000, 12, 7.25), pack_schedule, unpack_schedule)
+
+        def lookups():
+            for _ in range(500):
+                cache.get_or_compute("schedule", "k", None, pack_schedule, unpack_schedule)
+
+        threads = [threading.Thread(target=lookups) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert (cache.hits, cache.misses) == (4000, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import tempfile
+import unittest
+
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import models
+import sharding
+from DataService import data_service
+from DataService.data_service import DataService
+from migrations import migrate
+
+
+class ShardingTests(unittest.TestCase):
+    """
+    three sqlite files as shards, DataService pointed at them
+    """
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.engines = [create_engine("sqlite:///" + os.path.join(directory, "shard{}.db".format(index)))
+                        for index in range(3)]
+        for engine in self.engines:
+            migrate(engine)
+        sharding.allocator_metadata.create_all(bind=self.engines[0])
+        self.router = sharding.ShardRouter(self.engines)
+        session_factory = sessionmaker(**sharding.make_sharded_session_kwargs(
+            self.router, sharding.IdAllocator(self.engines[0], block_size=5)))
+        self.saved = (data_service.SessionLocal, data_service.shard_router)
+        data_service.SessionLocal = session_factory
+        data_service.shard_router = self.router
+
+    def tearDown(self):
+        data_service.SessionLocal, data_service.shard_router = self.saved
+
+    def count(self, shard_id, table):
+        with self.router.engines[shard_id].connect() as connection:
+            return connection.exec_driver_sql("select count(*) from " + table).scalar()
+
+    def create_users(self, count):
+        user_service = DataService(models.UserModel)
+        return [user_service.write_user("user{}@gmail.com".format(index), "foo", "bar")["data"].id
+                for index in range(count)]
+
+    def test_users_spread_by_hashed_id(self):
+        user_ids = self.create_users(12)
+        assert len(set(user_ids)) == 12
+        for user_id in user_ids:
+            shard_id = self.router.shard_for_id(user_id)
+            with self.router.engines[shard_id].connect() as connection:
+                assert connection.exec_driver_sql("select count(*) from users where id = ?", (user_id,)).scalar() == 1
+        assert sum(self.count(shard_id, "users") == 0 for shard_id in self.router.shard_ids) < 3
+
+        result = DataService(models.UserModel).get_all_users()
+        assert sorted(user.id for user in result["data"]) == sorted(user_ids)
+        assert DataService(models.UserModel).get_user_by_email("user7@gmail.com")["message"] == "user found"
+
+    def test_email_unique_across_shards(self):
+        user_ids = self.create_users(3)
+        with self.engines[0].connect() as connection:
+            rows = connection.execute(sharding.user_emails_table.select()).fetchall()
+        assert sorted(row.user_id for row in rows) == sorted(user_ids)
+
+        # a sign up that passed the per shard check concurrently on another shard already holds the email
+        with self.engines[0].begin() as connection:
+            connection.execute(sharding.user_emails_table.insert().values(email="taken@gmail.com", user_id=999))
+        with self.assertRaises(HTTPException) as raised:
+            DataService(models.UserModel).write_user("taken@gmail.com", "foo", "bar")
+        assert raised.exception.status_code == 400
+        assert sum(self.count(shard_id, "users") for shard_id in self.router.shard_ids) == 3
+
+    def test_backfill_user_emails(self):
+        user_ids = self.create_users(4)
+        with self.engines[0].begin() as connection:
+            connection.execute(sharding.user_emails_table.delete())
+        assert sharding.backfill_user_emails(self.engines) == 4
+        assert sharding.backfill_user_emails(self.engines) == 0
+        with self.engines[0].connect() as connection:
+            rows = connection.execute(sharding.user_emails_table.select()).fetchall()
+        assert sorted(row.user_id for row in rows) == sorted(user_ids)
+
+    def test_associations_live_with_loan(self):
+        user_ids = self.create_users(6)
+        loan_service = DataService(models.LoanModel)
+        loan_ids = [loan_service.create_loan(user_ids[:2], 1000 * (index + 1), 4.5, 12, user_ids[0])["data"]["id"]
+                    for index in range(6)]
+        loan_service.share_loan(user_ids[5], loan_ids[0])
+
+        for shard_id in self.router.shard_ids:
+            with self.router.engines[shard_id].connect() as connection:
+                rows = connection.exec_driver_sql("select loan_id from user_loans").fetchall()
+            assert all(self.router.shard_for_id(row[0]) == shard_id for row in rows)
+
+        loan = loan_service.get_loan(loan_ids[0])["data"]["loan_details"]
+        assert sorted(user.id for user in loan["users"]) == sorted([user_ids[0], user_ids[1], user_ids[5]])
+
+        user_loans = DataService(models.UserModel).get_user_loans(user_ids[1])["loans"]
+        assert sorted(loan.id for loan in user_loans) == sorted(loan_ids)
+        assert loan_service.get_loan_terms(loan_ids[3]) == (4000.0, 12, 4.5)
+
+    def test_execute_chooser_narrows_to_shard(self):
+        statement = models.LoanModel.__table__.select().where(models.LoanModel.id == 42)
+        assert sharding._shard_key_comparisons(statement)[0][1] == 42
+        statement = models.LoanModel.__table__.select().where(
+            (models.LoanModel.id == 42) | (models.LoanModel.amount > 1))
+        assert sharding._shard_key_comparisons(statement) is None
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import threading
+import time
+import unittest
+
+from singleflight import SingleFlight
+from schedule_cache import MemoryBackend, ScheduleCache, pack_schedule, unpack_schedule
+from amortization import build_schedule
+
+
+def run_concurrently(count, target):
+    results = [None] * count
+    errors = [None] * count
+
+    def worker(index):
+        try:
+            results[index] = target()
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+class SingleFlightTests(unittest.TestCase):
+    def test_concurrent_calls_share_one_run(self):
+        flight = SingleFlight("test")
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.2)
+            return "value"
+
+        results, errors = run_concurrently(8, lambda: flight.do("k", slow))
+        assert results == ["value"] * 8
+        assert len(calls) == 1
+        assert flight.in_flight() == 0
+
+    def test_errors_are_shared_and_not_kept(self):
+        flight = SingleFlight("test")
+
+        def failing():
+            time.sleep(0.2)
+            raise KeyError("missing")
+
+        results, errors = run_concurrently(4, lambda: flight.do("k", failing))
+        assert all(isinstance(error, KeyError) for error in errors)
+        assert flight.do("k", lambda: "retried") == "retried"
+
+    def test_different_keys_run_separately(self):
+        flight = SingleFlight("test")
+        assert flight.do("a", lambda: 1) == 1
+        assert flight.do("b", lambda: 2) == 2
+
+    def test_cache_misses_computed_once(self):
+        cache = ScheduleCache(MemoryBackend())
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return build_schedule(1000, 12, 7.25)
+
+        results, errors = run_concurrently(
+            6, lambda: cache.get_or_compute("schedule", "k", compute, pack_schedule, unpack_schedule))
+        assert len(calls) == 1
+        assert all(result == results[0] for result in results)
+        assert cache.misses == 1
+
+
+if __name__ == '__main__':
+    unittest.main()
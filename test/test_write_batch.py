@@ -0,0 +1,97 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from fastapi import HTTPException
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+import config
+import models
+import write_batch
+from DataService import data_service
+from DataService.data_service import DataService
+from database import make_engine
+from migrations import migrate
+from write_batch import WriteBatcher
+
+
+def run_concurrently(targets):
+    results = [None] * len(targets)
+
+    def worker(index):
+        try:
+            results[index] = targets[index]()
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(len(targets))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class WriteBatchTests(unittest.TestCase):
+    def setUp(self):
+        self.engine = make_engine("sqlite:///" + os.path.join(tempfile.mkdtemp(), "batch.db"))
+        migrate(self.engine)
+        self.session_factory = sessionmaker(bind=self.engine, autoflush=False)
+        self.commits = []
+        event.listen(self.engine, "commit", lambda connection: self.commits.append(1))
+        # wide window so every concurrent submit lands in one batch
+        self.batcher = WriteBatcher(self.session_factory, window=0.2)
+
+        self.saved = (data_service.SessionLocal, config.WRITE_BATCH_ENABLED, write_batch._write_batcher)
+        data_service.SessionLocal = self.session_factory
+        config.WRITE_BATCH_ENABLED = True
+        write_batch._write_batcher = self.batcher
+
+    def tearDown(self):
+        self.batcher.stop()
+        data_service.SessionLocal, config.WRITE_BATCH_ENABLED, write_batch._write_batcher = self.saved
+
+    def test_sqlite_pragmas(self):
+        with self.engine.connect() as connection:
+            assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+            assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+
+    def test_concurrent_writes_share_one_commit(self):
+        user_service = DataService(models.UserModel)
+        results = run_concurrently([
+            lambda index=index: user_service.write_user("batch{}@gmail.com".format(index), "foo", "bar")
+            for index in range(10)])
+        assert len({result["data"].id for result in results}) == 10
+        assert results[0]["data"].email.startswith("batch")
+        assert len(self.commits) == 1
+
+    def test_failed_write_only_fails_its_caller(self):
+        user_service = DataService(models.UserModel)
+        user_service.write_user("taken@gmail.com", "foo", "bar")
+        self.commits.clear()
+
+        emails = ["taken@gmail.com", "free1@gmail.com", "free2@gmail.com"]
+        results = run_concurrently([lambda email=email: user_service.write_user(email, "foo", "bar")
+                                    for email in emails])
+        assert isinstance(results[0], HTTPException)
+        assert results[1]["data"].email == "free1@gmail.com"
+        assert results[2]["data"].email == "free2@gmail.com"
+        # the batch is rolled back and replayed one write per transaction
+        assert len(self.commits) == 2
+
+    def test_loans_and_shares_batched(self):
+        user_id = DataService(models.UserModel).write_user("owner@gmail.com", "foo", "bar")["data"].id
+        other_id = DataService(models.UserModel).write_user("other@gmail.com", "foo", "bar")["data"].id
+        loan_service = DataService(models.LoanModel)
+        loans = run_concurrently([lambda: loan_service.create_loan([user_id], 1000, 5.0, 12, user_id)
+                                  for _ in range(5)])
+        loan_ids = [loan["data"]["id"] for loan in loans]
+        run_concurrently([lambda loan_id=loan_id: loan_service.share_loan(other_id, loan_id)
+                          for loan_id in loan_ids + loan_ids])
+        assert sorted(loan.id for loan in loan_service.get_user_loans(other_id)["loans"]) == sorted(loan_ids)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,13 @@
-import math
+import hashlib
 import re
 
 from fastapi import HTTPException
 
 import models
+# the amortization math lives in amortization.py, re-exported here for existing callers
+from amortization import SCHEDULE_ALGORITHM_VERSION, calculate_emi, build_schedule, build_summary
+from DataService.data_service import DataService
+
 
 def check_email(email):
     """
@@ -33,24 +37,35 @@ def check_loan_details(loan_amount, loan_interest, loan_months):
         raise HTTPException(status_code=400, detail="invalid loan_months please enter an integer value <=360(30 years)")
 
 
-def calculate_emi(amount, term_months, interest):
+def schedule_etag(amount, term_months, interest, *extra):
     """
-    calculates the emi or monthly payment
+    strong ETag for output that is a pure function of the loan terms
     :param amount:
     :param term_months:
     :param interest:
-    :return:
+    :param extra: anything else the output depends on, e.g. the summary month
+    :return: quoted etag string
     """
-    monthly_interest_rate = (interest / 100) / 12
-    numerator = monthly_interest_rate * math.pow((1 + monthly_interest_rate), term_months)
-    denominator = ((math.pow(1 + monthly_interest_rate, term_months)) - 1)
+    key = ":".join(repr(part) for part in (SCHEDULE_ALGORITHM_VERSION, amount, term_months, interest) + extra)
+    return '"' + hashlib.sha256(key.encode()).hexdigest()[:32] + '"'
+
 
-    EMI_raw = amount * (numerator / denominator)
-    result = {
-        "EMI_raw": EMI_raw,
-        "monthly_interest_rate": monthly_interest_rate
-    }
-    return result
+def etag_matches(if_none_match, etag):
+    """
+    checks an If-None-Match header value against an etag
+    :param if_none_match: raw header value, may hold several comma separated tags or *
+    :param etag: quoted etag
+    :return: boolean
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+    return False
 
 
 def check_user_details(user_ids, owner_user_id):
@@ -60,7 +75,6 @@ def check_user_details(user_ids, owner_user_id):
     :param owner_user_id: owners user id
     :return: boolean
     """
-    from DataService.data_service import DataService
     try:
         data_service = DataService(models.UserModel)
         if not isinstance(owner_user_id, int):
@@ -0,0 +1,104 @@
+import threading
+
+from sqlalchemy import func
+
+import config
+import models
+from database import SessionLocal
+from DataService.data_service import DataService
+
+
+class Readiness:
+    """
+    startup state reported by /health/ready, traffic should only be routed once ready is set
+    """
+
+    def __init__(self):
+        self.status = "starting"
+        self.warmed = 0
+        self.total = 0
+        self.error = None
+        self._ready = threading.Event()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def mark_ready(self, status="ready"):
+        self.status = status
+        self._ready.set()
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def as_dict(self):
+        return {
+            "status": self.status,
+            "warmed": self.warmed,
+            "total": self.total,
+            "error": self.error
+        }
+
+
+readiness = Readiness()
+
+
+def hot_loan_terms(loan_ids=None, limit=100):
+    """
+    term tuples worth precomputing, either for the given loans or the most common ones across the book
+    :param loan_ids: explicit loan ids, overrides the frequency lookup
+    :param limit: number of most common term tuples
+    :return: list of (amount, term_months, interest)
+    """
+    db_session = SessionLocal()
+    try:
+        loan = models.LoanModel
+        query = db_session.query(loan.amount, loan.term_months, loan.interest)
+        if loan_ids:
+            rows = query.filter(loan.id.in_(loan_ids)).distinct().all()
+        else:
+            rows = query.group_by(loan.amount, loan.term_months, loan.interest) \
+                .order_by(func.count(loan.id).desc()).limit(limit).all()
+        return [tuple(row) for row in rows]
+    finally:
+        db_session.close()
+
+
+def warm_schedule_cache(state=None, loan_ids=None, limit=100):
+    """
+    precomputes schedules into the schedule cache then marks the service ready.
+    a failed warm-up still marks it ready, a cold cache is slower but not broken.
+    :param state: Readiness to report progress on, defaults to the module readiness
+    :param loan_ids:
+    :param limit:
+    :return:
+    """
+    state = state or readiness
+    state.status = "warming"
+    try:
+        loan_terms = hot_loan_terms(loan_ids=loan_ids, limit=limit)
+        state.total = len(loan_terms)
+        data_service = DataService(models.LoanModel)
+        for terms in loan_terms:
+            data_service.schedule_for_terms(terms)
+            state.warmed += 1
+        state.mark_ready()
+    except Exception as e:
+        state.error = str(e)
+        state.mark_ready("ready (warm-up failed)")
+
+
+def start_warmup(state=None):
+    """
+    runs the warm-up in a background thread, or marks ready straight away when disabled
+    :return: the thread, if one was started
+    """
+    state = state or readiness
+    if not config.WARMUP_ENABLED:
+        state.mark_ready()
+        return None
+    thread = threading.Thread(target=warm_schedule_cache, name="schedule-warmup", daemon=True,
+                              kwargs={"state": state, "loan_ids": config.WARMUP_LOAN_IDS,
+                                      "limit": config.WARMUP_TOP_TERMS})
+    thread.start()
+    return thread
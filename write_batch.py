@@ -0,0 +1,141 @@
+import queue
+import threading
+import time
+
+import config
+import metrics
+
+WRITE_BATCH_SIZE = metrics.REGISTRY.register(metrics.Histogram(
+    "write_batch_size", "writes committed per group commit transaction",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)))
+WRITE_BATCH_RETRIES = metrics.REGISTRY.register(metrics.Counter(
+    "write_batch_retries_total", "batches rolled back because one write failed and replayed one write at a time"))
+
+
+class _PendingWrite:
+    __slots__ = ("operation", "done", "result", "error")
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class WriteBatcher:
+    """
+    group commit: writes submitted from many request threads are collected for up to `window` seconds by one
+    writer thread and committed in a single transaction, so sqlite takes its write lock and syncs once per
+    batch instead of once per write.
+
+    operations take a session, write through it (flushing so errors surface there) and return their result
+    without committing. the session reads from the primary, operations check what they are about to write. if any operation of a batch raises, the batch is rolled back and replayed one
+    operation per transaction, so every caller gets exactly its own result or error.
+    """
+
+    def __init__(self, session_factory, window=0.002, max_batch=100):
+        self._session_factory = session_factory
+        self._window = window
+        self._max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, operation):
+        """
+        :param operation: callable(session) -> result
+        :return: the operation's result once its transaction committed
+        """
+        self._ensure_started()
+        pending = _PendingWrite(operation)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    thread = threading.Thread(target=self._run, name="write-batcher", daemon=True)
+                    thread.start()
+                    self._thread = thread
+
+    def stop(self):
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            stopping = False
+            deadline = time.monotonic() + self._window
+            while len(batch) < self._max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if pending is None:
+                    stopping = True
+                    break
+                batch.append(pending)
+            self._commit(batch)
+            if stopping:
+                return
+
+    def _commit(self, batch):
+        WRITE_BATCH_SIZE.observe(len(batch))
+        session = self._session_factory(expire_on_commit=False, info={"primary": True})
+        try:
+            results = [pending.operation(session) for pending in batch]
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            error = e
+        else:
+            error = None
+        finally:
+            session.close()
+
+        if error is None:
+            for pending, result in zip(batch, results):
+                pending.result = result
+                pending.done.set()
+        elif len(batch) == 1:
+            batch[0].error = error
+            batch[0].done.set()
+        else:
+            WRITE_BATCH_RETRIES.inc()
+            for pending in batch:
+                self._commit([pending])
+
+
+_write_batcher = None
+_write_batcher_lock = threading.Lock()
+
+
+def get_write_batcher():
+    """
+    process wide write batcher, None unless WRITE_BATCH_ENABLED
+    """
+    global _write_batcher
+    if not config.WRITE_BATCH_ENABLED:
+        return None
+    if _write_batcher is None:
+        with _write_batcher_lock:
+            if _write_batcher is None:
+                from database import SessionLocal
+
+                _write_batcher = WriteBatcher(SessionLocal, window=config.WRITE_BATCH_WINDOW_MS / 1000,
+                                              max_batch=config.WRITE_BATCH_MAX_SIZE)
+    return _write_batcher